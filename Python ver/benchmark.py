@@ -0,0 +1,616 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from functools import partial
+
+import numpy as np
+
+from file_enumerator import FileEnumerator
+import json_backend
+from json_backend import PARSERS, orjson
+from json_file_manager import LOW_MEMORY_BUDGET, PositionGridIndex, PositionStore, find_duplicate_and_near_duplicate_positions, group_positions, round_position
+from position_reader import POSITION_BACKENDS
+from scan_stats import ScanStats
+
+# Corpus sizes for the pipeline benchmark.
+TIERS = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+RESULTS_FORMAT = 1
+
+
+def generate_positions(count, dims=3, spread=1000.0, near_ratio=0.1, jitter=0.5, seed=0):
+    rng = random.Random(seed)
+    positions = []
+    for _ in range(count):
+        if positions and rng.random() < near_ratio:
+            base = rng.choice(positions)
+            positions.append(tuple(x + rng.uniform(-jitter, jitter) for x in base))
+        else:
+            positions.append(tuple(rng.uniform(0, spread) for _ in range(dims)))
+    return positions
+
+
+def group_near_linear(positions, tolerance, limit=None):
+    # The pre-index implementation: every new position is compared against every existing group.
+    group_positions = []
+    for index, position in enumerate(positions):
+        if limit is not None and index >= limit:
+            break
+        for existing_position in group_positions:
+            if np.all(np.abs(np.array(position) - np.array(existing_position)) <= tolerance):
+                break
+        else:
+            group_positions.append(position)
+    return group_positions
+
+
+def group_near_indexed(positions, tolerance):
+    position_index = PositionGridIndex(tolerance)
+    for position in positions:
+        if position_index.find(position) is None:
+            position_index.add(position)
+    return position_index
+
+
+def bench_near_duplicates(sizes, tolerance, linear_limit):
+    print(f"{'positions':>10} {'grid (s)':>10} {'linear (s)':>12} {'speedup':>10}")
+    for size in sizes:
+        positions = generate_positions(size)
+
+        start = time.perf_counter()
+        group_near_indexed(positions, tolerance)
+        grid_time = time.perf_counter() - start
+
+        # The linear scan is quadratic, so past linear_limit positions it is timed on a prefix and
+        # extrapolated.
+        measured = min(size, linear_limit)
+        start = time.perf_counter()
+        group_near_linear(positions, tolerance, limit=measured)
+        linear_time = (time.perf_counter() - start) * (size / measured) ** 2
+        estimated = "~" if measured < size else ""
+
+        print(f"{size:>10} {grid_time:>10.2f} {estimated + format(linear_time, '.2f'):>12} {linear_time / grid_time:>9.0f}x")
+
+
+def group_exact_per_file(paths, positions, num_decimals):
+    # The pre-columnar implementation: round and look up one file at a time.
+    position_to_files = {}
+    duplicate_positions = set()
+    for file_path, position in zip(paths, positions):
+        rounded_position = round_position(position, num_decimals, file_path)
+        if rounded_position in position_to_files:
+            position_to_files[rounded_position].append(file_path)
+            duplicate_positions.add(rounded_position)
+        else:
+            position_to_files[rounded_position] = [file_path]
+    return position_to_files, duplicate_positions
+
+
+def bench_grouping(sizes, num_decimals, tolerance):
+    print(f"{'positions':>10} {'per-file (s)':>13} {'columnar (s)':>13} {'+near (s)':>10}")
+    for size in sizes:
+        positions = generate_positions(size, near_ratio=0.2, jitter=tolerance)
+        paths = [f"/data/{index % 1000}/{index}.json" for index in range(size)]
+        store = PositionStore()
+        for file_path, position in zip(paths, positions):
+            store.add(file_path, position)
+
+        start = time.perf_counter()
+        group_exact_per_file(paths, positions, num_decimals)
+        per_file_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        group_positions(store, num_decimals=num_decimals)
+        columnar_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        group_positions(store, num_decimals=num_decimals, find_near_duplicates=True, tolerance=tolerance)
+        near_time = time.perf_counter() - start
+
+        print(f"{size:>10} {per_file_time:>13.2f} {columnar_time:>13.2f} {near_time:>10.2f}")
+
+
+def group_per_file(entries, num_decimals, find_near_duplicates, tolerance):
+    # What the scan did before the columnar store: every file is rounded and matched on its own as
+    # it comes in, near duplicates against a grid index per partition and dimensionality.
+    position_to_files = {}
+    duplicate_positions = set()
+    near_duplicate_positions = set()
+    duplicates = set()
+    near_duplicates = set()
+    position_indices = {}
+    for file_path, position, partition in entries:
+        if num_decimals is not None:
+            position = round_position(position, num_decimals, file_path)
+        position = tuple(float(x) for x in position)
+        key = partition + position
+        if key in position_to_files:
+            position_to_files[key].append(file_path)
+            duplicate_positions.add(key)
+            duplicates.add(file_path)
+            continue
+        if find_near_duplicates and position:
+            position_index = position_indices.setdefault((partition, len(position)), PositionGridIndex(tolerance))
+            existing_position = position_index.find(position)
+            if existing_position is not None:
+                position_to_files[partition + existing_position].append(file_path)
+                near_duplicate_positions.add(partition + existing_position)
+                near_duplicates.add(file_path)
+                continue
+            position_index.add(position)
+        position_to_files[key] = [file_path]
+    return position_to_files, duplicate_positions, near_duplicate_positions, duplicates, near_duplicates
+
+
+def random_entries(rng, count):
+    # Positions made to collide: a few coordinate values (including -0.0 and values on a rounding
+    # boundary), jittered copies of earlier positions, mixed dimensionalities, partitions and
+    # repeated path prefixes.
+    entries = []
+    for index in range(count):
+        partition = rng.choice([(), (), ('a',), ('b', 'c')])
+        if entries and rng.random() < 0.4:
+            _, base, partition = rng.choice(entries)
+            position = tuple(x + rng.choice([0, 0, 0.004, 0.3, 1.0]) * rng.uniform(-1, 1) for x in base)
+        else:
+            dims = rng.choice([3, 3, 3, 2, 6, 0])
+            position = tuple(rng.choice([-0.0, 0.0, 1.25, 2.675, round(rng.uniform(-5, 5), rng.randint(0, 3))]) for _ in range(dims))
+        entries.append((f"/data/{rng.randint(0, 9)}/sub/{index}.json", position, partition))
+    return entries
+
+
+def check_grouping(trials, seed):
+    # Self-check of the batch grouping (sorting, spill buckets, cell coding, first-seen numbering)
+    # against group_per_file on random inputs, in memory and in low-memory mode with budgets small
+    # enough to spill. Returns whether every trial matched.
+    rng = random.Random(seed)
+    failures = 0
+    spilled_trials = 0
+    for trial in range(trials):
+        entries = random_entries(rng, rng.choice([1, 2, 50, 500, 3000]))
+        num_decimals = rng.choice([None, 0, 1, 2])
+        find_near_duplicates = rng.random() < 0.6
+        tolerance = rng.choice([0.3, 1.0, 2.5])
+        low_memory = rng.random() < 0.5
+        store = PositionStore(low_memory=low_memory, memory_budget=rng.choice([256, 4096, LOW_MEMORY_BUDGET]), num_decimals=num_decimals)
+        try:
+            for file_path, position, partition in entries:
+                store.add(file_path, position, partition)
+            result = group_positions(store, num_decimals, find_near_duplicates, tolerance)
+            spilled_trials += store.spill_count > 0
+        finally:
+            store.close()
+        expected = group_per_file(entries, num_decimals, find_near_duplicates, tolerance)
+        position_to_files = [(key, list(files)) for key, files in result[0].items()]
+        expected_groups = [(key, files) for key, files in expected[0].items() if not low_memory or len(files) > 1]
+        if position_to_files != expected_groups or result[1:] != expected[1:]:
+            failures += 1
+            print(f"trial {trial}: mismatch with {len(entries)} files, decimals {num_decimals}, near {find_near_duplicates}, "
+                  f"tolerance {tolerance}, low memory {low_memory}")
+    print(f"{trials - failures}/{trials} trials matched ({spilled_trials} spilled)")
+    return failures == 0
+
+
+# Words for generated notes, about one in ten non-ASCII; json.dump writes those as \u escapes.
+NOTE_WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do", "eiusmod", "tempor",
+              "incididunt", "ut", "labore", "et", "dolore", "magna", "aliqua", "enim", "ad", "minim", "Größe", "東京"]
+
+
+def generate_note(rng, length):
+    words = []
+    while sum(len(word) + 1 for word in words) < length:
+        words.append(rng.choice(NOTE_WORDS))
+    return " ".join(words)
+
+
+class StopAfter:
+    # A batch control that stops the batch after a number of operations, like a crash would.
+    def __init__(self, count):
+        self.count = count
+
+    def checkpoint(self):
+        self.count -= 1
+        if self.count < 0:
+            raise KeyboardInterrupt()
+
+
+def check_file_operations():
+    # Self-check of journaled moves, resume and undo in a scratch directory. Returns whether every
+    # step left the files where they belong, with their own contents.
+    import file_operations
+
+    failures = []
+
+    def expect(condition, description):
+        if not condition:
+            failures.append(description)
+
+    def write(file_path, text):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as f:
+            f.write(text)
+
+    def read(file_path):
+        try:
+            with open(file_path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source")
+        destination = os.path.join(directory, "destination")
+        journal = os.path.join(directory, "journals", "move.jsonl")
+        files = {os.path.join(source, name): name for name in ("a/x.json", "b/x.json", "c/y.json")}
+        for file_path, text in files.items():
+            write(file_path, text)
+        write(os.path.join(destination, "y.json"), "already there")
+
+        operations = file_operations.plan_moves(list(files), destination)
+        destinations = [target for _, target in operations]
+        expect(len(set(destinations)) == len(destinations), "plan_moves gave two files the same destination")
+        expect(not any(os.path.exists(target) for target in destinations), "plan_moves planned a move onto an existing file")
+        result = file_operations.FileOperationBatch(operations, journal).run()
+        expect(not result.failed and all(read(target) == files[moved] for moved, target in operations), "move lost or mixed up files")
+        expect(read(os.path.join(destination, "y.json")) == "already there", "move replaced an existing file")
+
+        result = file_operations.undo_journal(journal, undo_journal_path=journal + ".undo")
+        expect(not result.failed and all(read(file_path) == text for file_path, text in files.items()), "undo did not restore every file")
+        expect(read(os.path.join(destination, "y.json")) == "already there", "undo touched a file it did not move")
+
+        # A second move into the same folder goes around what the first one left there.
+        file_operations.FileOperationBatch(file_operations.plan_moves(list(files), destination)).run()
+        for file_path, text in files.items():
+            write(file_path, text)
+        result = file_operations.FileOperationBatch(file_operations.plan_moves(list(files), destination)).run()
+        expect(not result.failed and len(os.listdir(destination)) == 7, "a second move into the same folder failed")
+
+        # A file that appears at a destination after planning is left alone, and the move is not
+        # journaled as done.
+        shutil.rmtree(destination)
+        for file_path, text in files.items():
+            write(file_path, text)
+        operations = file_operations.plan_moves(list(files), destination)
+        write(operations[0][1], "arrived later")
+        result = file_operations.FileOperationBatch(operations, journal).run()
+        expect(list(result.failed) == [operations[0][0]] and read(operations[0][1]) == "arrived later", "move replaced a file that appeared after planning")
+        expect(0 not in file_operations.read_journal(journal)[1], "a failed move was journaled as done")
+        file_operations.undo_journal(journal)
+        expect(read(operations[0][1]) == "arrived later" and all(read(file_path) == text for file_path, text in files.items()), "undo after a failed move went wrong")
+
+        # A batch stopped part way (and a hard link left by a crash between link and unlink) is
+        # finished by resume.
+        shutil.rmtree(destination)
+        operations = file_operations.plan_moves(list(files), destination)
+        try:
+            file_operations.FileOperationBatch(operations, journal, control=StopAfter(1)).run()
+        except KeyboardInterrupt:
+            pass
+        expect(len(file_operations.read_journal(journal)[1]) == 1, "a stopped batch journaled the wrong operations")
+        os.link(operations[1][0], operations[1][1])
+        result = file_operations.resume_journal(journal)
+        expect(not result.failed and all(read(target) == files[moved] and not os.path.exists(moved) for moved, target in operations), "resume did not finish the batch")
+
+        # Moves across devices go through copy_move_file, which must not replace files either.
+        write(os.path.join(directory, "other", "z.json"), "other")
+        try:
+            file_operations.copy_move_file(os.path.join(directory, "other", "z.json"), operations[0][1])
+            expect(False, "copy_move_file replaced an existing file")
+        except FileExistsError:
+            expect(read(operations[0][1]) == files[operations[0][0]], "copy_move_file damaged an existing file")
+
+        # Deletes are not undone.
+        operations = file_operations.plan_deletes([target for _, target in operations])
+        file_operations.FileOperationBatch(operations, journal).run()
+        result = file_operations.undo_journal(journal)
+        expect(not result.completed and not any(os.path.exists(file_path) for file_path, _ in operations), "delete or its undo went wrong")
+
+    for failure in failures:
+        print(f"file operations: {failure}")
+    print(f"file operations: {'ok' if not failures else f'{len(failures)} checks failed'}")
+    return not failures
+
+
+def write_payload_file(file_path, payload_size, position_first=True, seed=0):
+    rng = random.Random(seed)
+    payload = []
+    size = 0
+    while size < payload_size:
+        item = {"id": len(payload), "tags": ["a", "b"], "value": rng.random(), "note": generate_note(rng, rng.randint(10, 200))}
+        payload.append(item)
+        size += len(json.dumps(item)) + 6
+    position = [rng.uniform(0, 1000) for _ in range(3)]
+    data = {"position": position, "payload": payload} if position_first else {"payload": payload, "position": position}
+    with open(file_path, 'w') as f:
+        json.dump(data, f, indent=4)
+
+
+def bench_extraction(sizes, repeat, position_first):
+    def json_load(file_path):
+        # What extract_positions did before the pluggable backends.
+        with open(file_path, 'r') as f:
+            return json.load(f).get('position')
+
+    readers = {'json.load': json_load}
+    readers.update(POSITION_BACKENDS)
+    print(f"{'file size':>10} " + " ".join(f"{name + ' (ms)':>14}" for name in readers))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            file_path = os.path.join(directory, f"{size}.json")
+            write_payload_file(file_path, size, position_first)
+            timings = []
+            for read in readers.values():
+                read(file_path)
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    read(file_path)
+                timings.append((time.perf_counter() - start) / repeat * 1000)
+            print(f"{size:>10} " + " ".join(f"{timing:>14.3f}" for timing in timings))
+
+
+def generate_document(rng, payload_size):
+    # A document with a mix of what the parsers have to deal with: nested objects, integers, floats
+    # of every magnitude and non-ASCII text.
+    payload = []
+    size = 0
+    while size < payload_size:
+        item = {"id": len(payload), "value": rng.random() * 10 ** rng.randint(-8, 20), "tags": ["a", "b"], "note": "x" * rng.randint(10, 100) + " é"}
+        payload.append(item)
+        size += len(json.dumps(item)) + 12
+    return {"name": "item", "position": [rng.uniform(0, 1000) for _ in range(3)], "payload": payload}
+
+
+def bench_json_backends(count, payload_size, repeat):
+    # Parse throughput of every installed parser, and serialize throughput of json and orjson
+    # together with how often their output matches what the manager writes (json indented or
+    # compact), which is why files are always written with json.
+    rng = random.Random(0)
+    documents = [generate_document(rng, payload_size) for _ in range(count)]
+    encoded = [json.dumps(document, indent=4).encode() for document in documents]
+    total_bytes = sum(map(len, encoded))
+    print(f"{count} documents, {total_bytes // count} bytes each")
+
+    def best_time(function, items):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for item in items:
+                function(item)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    print(f"{'parse':<16} {'docs/s':>10} {'MB/s':>8}")
+    for name, parse in PARSERS.items():
+        seconds = best_time(parse, encoded)
+        print(f"{name:<16} {count / seconds:>10.0f} {total_bytes / seconds / 1e6:>8.1f}")
+
+    indented = partial(json.dumps, indent=4)
+    compact = partial(json.dumps, separators=(',', ':'))
+    serializers = {"json indented": (indented, indented), "json compact": (compact, compact)}
+    if orjson is not None:
+        serializers["orjson indented"] = (lambda data: orjson.dumps(data, option=orjson.OPT_INDENT_2).decode(), indented)
+        serializers["orjson compact"] = (lambda data: orjson.dumps(data).decode(), compact)
+    print(f"{'serialize':<16} {'docs/s':>10} {'MB/s':>8} {'same output':>12}")
+    for name, (serialize, reference) in serializers.items():
+        seconds = best_time(serialize, documents)
+        same = sum(serialize(document) == reference(document) for document in documents) / count
+        print(f"{name:<16} {count / seconds:>10.0f} {total_bytes / seconds / 1e6:>8.1f} {same:>11.0%}")
+
+
+def generate_corpus(directory, count, depth=2, fanout=10, payload_size=0, duplicate_ratio=0.1, near_ratio=0.1, jitter=0.5, spread=1000.0, seed=0):
+    # Writes count JSON files shaped like the ones the manager works on, spread over depth levels of
+    # fanout subdirectories. duplicate_ratio of the files copy an earlier position exactly and
+    # near_ratio move an earlier one by up to jitter on every axis. The same arguments always
+    # produce the same corpus.
+    rng = random.Random(seed)
+    payload = []
+    size = 0
+    while size < payload_size:
+        item = {"id": len(payload), "value": rng.random(), "note": "x" * rng.randint(10, 100)}
+        payload.append(item)
+        size += len(json.dumps(item)) + 12
+    positions = []
+    for index in range(count):
+        roll = rng.random()
+        if positions and roll < duplicate_ratio:
+            position = list(rng.choice(positions))
+        elif positions and roll < duplicate_ratio + near_ratio:
+            position = [x + rng.uniform(-jitter, jitter) for x in rng.choice(positions)]
+        else:
+            position = [rng.uniform(0, spread) for _ in range(3)]
+        positions.append(position)
+        parts = [f"d{(index // fanout ** level) % fanout}" for level in range(depth, 0, -1)]
+        file_directory = os.path.join(directory, *parts)
+        if not os.path.isdir(file_directory):
+            os.makedirs(file_directory)
+        data = {"name": f"item {index}", "description": "generated", "position": position}
+        if payload:
+            data["payload"] = payload
+        with open(os.path.join(file_directory, f"{index}.json"), 'w') as f:
+            json.dump(data, f, indent=4)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_scan(directory, **options):
+    stats = ScanStats()
+    start = time.perf_counter()
+    find_duplicate_and_near_duplicate_positions(directory, set(), set(), stats=stats, **options)
+    return time.perf_counter() - start, stats
+
+
+def bench_tier(count, args):
+    # Times one corpus size: generation, a bare listing, an exact scan, a scan with near-duplicate
+    # matching and finally a cleaning scan that rewrites every file (run last, as it changes the
+    # corpus).
+    result = {"files": count}
+    with tempfile.TemporaryDirectory(dir=args.corpus_root) as directory:
+        start = time.perf_counter()
+        generate_corpus(directory, count, depth=args.depth, fanout=args.fanout, payload_size=args.payload, duplicate_ratio=args.duplicate_ratio, near_ratio=args.near_ratio, jitter=args.jitter, seed=args.seed)
+        result["generate_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in FileEnumerator(directory):
+            pass
+        enumerate_seconds = time.perf_counter() - start
+
+        scan_options = {"num_decimals": args.decimals, "workers": args.workers or None, "position_backend": args.backend, "low_memory": args.low_memory, "memory_budget": args.memory_budget * 1024 * 1024}
+        exact_seconds, exact_stats = run_scan(directory, **scan_options)
+        near_seconds, near_stats = run_scan(directory, find_near_duplicates=True, tolerance=args.tolerance, **scan_options)
+        clean_seconds, clean_stats = run_scan(directory, update_name=True, round_positions=True, **scan_options)
+
+    result["stages"] = {
+        "enumerate": enumerate_seconds,
+        # Per-file reading and parsing only; stat and the other per-file laps are left out.
+        "read_parse": sum(exact_stats.file_seconds.get(stage, 0.0) for stage in ("read", "scan", "parse")),
+        "group_exact": exact_stats.stage_seconds["grouping"],
+        "group_near": near_stats.stage_seconds["near_duplicates"],
+        "clean_write_back": clean_stats.file_seconds.get("operations", 0.0) + clean_stats.file_seconds.get("write", 0.0),
+    }
+    result["pipeline"] = {"exact": exact_seconds, "near": near_seconds, "clean": clean_seconds}
+    result["files_per_second"] = count / exact_seconds if exact_seconds > 0 else None
+    result["reports"] = {name: stats.to_dict() for name, stats in (("exact", exact_stats), ("near", near_stats), ("clean", clean_stats))}
+    return result
+
+
+def bench_pipeline(args):
+    # Results are written as JSON so that runs from different versions can be compared with the
+    # compare benchmark.
+    results = {
+        "format": RESULTS_FORMAT,
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "json_backend": json_backend.BACKEND,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "parameters": {name: getattr(args, name) for name in ("depth", "fanout", "payload", "duplicate_ratio", "near_ratio", "jitter", "seed", "decimals", "tolerance", "workers", "backend", "low_memory", "memory_budget")},
+        "tiers": [],
+    }
+    print(f"{'files':>10} {'enumerate':>10} {'read+parse':>11} {'group exact':>12} {'group near':>11} {'write-back':>11} {'scan (s)':>9} {'files/s':>9}")
+    for tier in args.tiers:
+        result = bench_tier(TIERS[tier], args)
+        results["tiers"].append(result)
+        stages = result["stages"]
+        print(
+            f"{result['files']:>10} {stages['enumerate']:>10.2f} {stages['read_parse']:>11.2f} {stages['group_exact']:>12.2f} "
+            f"{stages['group_near']:>11.2f} {stages['clean_write_back']:>11.2f} {result['pipeline']['exact']:>9.2f} {result['files_per_second']:>9.0f}"
+        )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+def compare_results(baseline_path, candidate_path, threshold):
+    # Prints candidate/baseline time ratios per tier and stage and returns whether any of them got
+    # slower by more than threshold (0.1 = 10%).
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+    if baseline.get("parameters") != candidate.get("parameters"):
+        print("warning: the runs used different parameters")
+    baseline_tiers = {tier["files"]: tier for tier in baseline["tiers"]}
+    regressed = False
+    print(f"{baseline.get('revision')} -> {candidate.get('revision')}")
+    print(f"{'files':>10} {'stage':>18} {'before (s)':>11} {'after (s)':>11} {'ratio':>7}")
+    for tier in candidate["tiers"]:
+        before = baseline_tiers.get(tier["files"])
+        if before is None:
+            continue
+        timings = dict(tier["stages"], **{f"pipeline_{name}": seconds for name, seconds in tier["pipeline"].items()})
+        before_timings = dict(before["stages"], **{f"pipeline_{name}": seconds for name, seconds in before["pipeline"].items()})
+        for stage, seconds in timings.items():
+            if stage not in before_timings:
+                continue
+            ratio = seconds / before_timings[stage] if before_timings[stage] > 0 else float("inf")
+            flag = ""
+            if ratio > 1 + threshold:
+                regressed = True
+                flag = " slower"
+            print(f"{tier['files']:>10} {stage:>18} {before_timings[stage]:>11.3f} {seconds:>11.3f} {ratio:>6.2f}x{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON File Manager benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    near_parser = subparsers.add_parser("near", help="near-duplicate grouping: grid index vs linear scan")
+    near_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    near_parser.add_argument("--tolerance", type=float, default=1.0)
+    near_parser.add_argument("--linear-limit", type=int, default=2_000)
+
+    group_parser = subparsers.add_parser("group", help="grouping: per-file dict lookups vs the columnar PositionStore")
+    group_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    group_parser.add_argument("--decimals", type=int, default=2)
+    group_parser.add_argument("--tolerance", type=float, default=1.0)
+
+    extract_parser = subparsers.add_parser("extract", help="position extraction: json.load vs the position_reader backends")
+    extract_parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000, 10_000_000])
+    extract_parser.add_argument("--repeat", type=int, default=20)
+    extract_parser.add_argument("--position-last", action="store_true", help="place 'position' after the payload")
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="full scans of generated corpora, per stage, with JSON results")
+    pipeline_parser.add_argument("--tiers", nargs="+", choices=list(TIERS), default=["1k", "10k", "100k"])
+    pipeline_parser.add_argument("--depth", type=int, default=2, help="directory levels")
+    pipeline_parser.add_argument("--fanout", type=int, default=10, help="subdirectories per level")
+    pipeline_parser.add_argument("--payload", type=int, default=0, help="approximate payload bytes per file")
+    pipeline_parser.add_argument("--duplicate-ratio", type=float, default=0.1)
+    pipeline_parser.add_argument("--near-ratio", type=float, default=0.1)
+    pipeline_parser.add_argument("--jitter", type=float, default=0.5)
+    pipeline_parser.add_argument("--seed", type=int, default=0)
+    pipeline_parser.add_argument("--decimals", type=int, default=2)
+    pipeline_parser.add_argument("--tolerance", type=float, default=1.0)
+    pipeline_parser.add_argument("--workers", type=int, default=1, help="0 for one per CPU")
+    pipeline_parser.add_argument("--backend", choices=sorted(POSITION_BACKENDS), default="scan")
+    pipeline_parser.add_argument("--low-memory", action="store_true", help="scan in low-memory mode")
+    pipeline_parser.add_argument("--memory-budget", type=int, default=LOW_MEMORY_BUDGET // (1024 * 1024), help="low-memory budget in MiB")
+    pipeline_parser.add_argument("--corpus-root", help="where to generate corpora (default: the system temp directory)")
+    pipeline_parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+
+    backends_parser = subparsers.add_parser("backends", help="parse/serialize throughput of the installed JSON backends")
+    backends_parser.add_argument("--count", type=int, default=2_000)
+    backends_parser.add_argument("--payload", type=int, default=2_000, help="approximate payload bytes per document")
+    backends_parser.add_argument("--repeat", type=int, default=5)
+
+    check_parser = subparsers.add_parser("check", help="self-checks: batch grouping vs per-file matching on random inputs, and journaled moves, resume and undo")
+    check_parser.add_argument("--trials", type=int, default=200)
+    check_parser.add_argument("--seed", type=int, default=0)
+
+    compare_parser = subparsers.add_parser("compare", help="compare two pipeline result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="flag stages slower by more than this fraction")
+
+    args = parser.parse_args()
+    if args.benchmark == "near":
+        bench_near_duplicates(args.sizes, args.tolerance, args.linear_limit)
+    elif args.benchmark == "group":
+        bench_grouping(args.sizes, args.decimals, args.tolerance)
+    elif args.benchmark == "extract":
+        bench_extraction(args.sizes, args.repeat, not args.position_last)
+    elif args.benchmark == "backends":
+        bench_json_backends(args.count, args.payload, args.repeat)
+    elif args.benchmark == "pipeline":
+        bench_pipeline(args)
+    elif args.benchmark == "check":
+        grouping_ok = check_grouping(args.trials, args.seed)
+        sys.exit(0 if check_file_operations() and grouping_ok else 1)
+    elif args.benchmark == "compare":
+        sys.exit(1 if compare_results(args.baseline, args.candidate, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import argparse
+import csv
+import json
+import os
+import sys
+
+from json_backend import PARSERS, use_backend
+from position_reader import POSITION_BACKENDS
+
+
+def iter_result_groups(position_to_files, duplicate_positions, near_duplicate_positions, relative_to=None):
+    # One record per position that has exact or near duplicates, in the order the groups were found.
+    for position, file_paths in position_to_files.items():
+        exact = position in duplicate_positions
+        near = position in near_duplicate_positions
+        if not (exact or near):
+            continue
+        if relative_to is not None:
+            file_paths = [os.path.relpath(file_path, relative_to) for file_path in file_paths]
+        # In the content matching modes the group key is the content hash rather than a position.
+        yield {'position': position if isinstance(position, str) else list(position), 'exact': exact, 'near': near, 'files': list(file_paths)}
+
+
+def relative_event(event, relative_to):
+    return dict(event, file=os.path.relpath(event['file'], relative_to), files=[os.path.relpath(file_path, relative_to) for file_path in event['files']])
+
+
+def write_jsonl(groups, stream):
+    count = 0
+    for group in groups:
+        stream.write(json.dumps(group) + '\n')
+        stream.flush()
+        count += 1
+    return count
+
+
+def write_csv(groups, stream):
+    writer = csv.writer(stream)
+    writer.writerow(['group', 'position', 'exact', 'near', 'file'])
+    count = 0
+    for count, group in enumerate(groups, start=1):
+        position = group['position'] if isinstance(group['position'], str) else json.dumps(group['position'])
+        for file_path in group['files']:
+            writer.writerow([count, position, group['exact'], group['near'], file_path])
+        stream.flush()
+    return count
+
+
+WRITERS = {
+    'jsonl': write_jsonl,
+    'csv': write_csv,
+}
+
+
+def write_groups(groups, stream, output_format='jsonl'):
+    return WRITERS[output_format](groups, stream)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Find exact and near duplicate JSON files by their 'position' field without the GUI.")
+    parser.add_argument('directory', help="directory to scan")
+    parser.add_argument('--pattern', action='append', help="glob for files to scan, may be repeated (default: *.json)")
+    parser.add_argument('--exclude', action='append', default=[], help="glob for files to skip, may be repeated")
+    parser.add_argument('--exclude-dir', action='append', default=[], help="glob for directories not to descend into, may be repeated")
+    parser.add_argument('--max-depth', type=int, default=None, help="how many directory levels below DIRECTORY to scan (0 = only DIRECTORY)")
+    parser.add_argument('--ignore-empty', action='store_true', help="skip files without a position")
+
+    cleaning = parser.add_argument_group('cleaning options (these rewrite files)')
+    cleaning.add_argument('--clear-name', action='store_true', help="clear the 'name' field")
+    cleaning.add_argument('--write-filename-to-name', action='store_true', help="write the filename to the 'name' field")
+    cleaning.add_argument('--remove-description', action='store_true', help="remove the 'description' field")
+    cleaning.add_argument('--round-positions', action='store_true', help="round the stored positions (the first --key) to --decimals")
+    cleaning.add_argument('--name-field', default='name', help="key path --write-filename-to-name writes to (default: %(default)s)")
+    cleaning.add_argument('--cleared-field', default='name', help="key path --clear-name clears (default: %(default)s)")
+    cleaning.add_argument('--compact', action='store_true', help="write rewritten files as compact JSON instead of indented")
+    cleaning.add_argument('--fsync', action='store_true', help="flush rewritten files to disk before returning (slower, survives power loss)")
+    cleaning.add_argument('--description-field', default='description', help="key path --remove-description removes (default: %(default)s)")
+
+    duplicates = parser.add_argument_group('duplicate options')
+    duplicates.add_argument('--key', action='append', help="key path to match on, e.g. transform.translation; repeat for a compound key (default: position)")
+    duplicates.add_argument('--match', choices=['position', 'content', 'normalized'], default='position', help="what makes files duplicates: their position, identical bytes, or identical JSON after normalization (default: %(default)s)")
+    duplicates.add_argument('--ignore-field', action='append', default=[], help="top-level field left out of --match normalized, may be repeated")
+    duplicates.add_argument('--decimals', type=int, default=None, help="round positions to this many decimals before matching")
+    duplicates.add_argument('--find-similar', action='store_true', help="also match positions within --tolerance on every axis")
+    duplicates.add_argument('--tolerance', type=float, default=0.9, help="similarity threshold (default: %(default)s)")
+
+    scanning = parser.add_argument_group('scanning')
+    scanning.add_argument('--workers', type=int, default=1, help="worker processes, 0 for one per CPU (default: %(default)s)")
+    scanning.add_argument('--cache', action='store_true', help="use the scan cache to skip unchanged files")
+    scanning.add_argument('--rebuild-cache', action='store_true', help="re-parse every file and rebuild the scan cache")
+    scanning.add_argument('--cache-path', metavar='FILE', help="scan cache file, implies --cache (default: scan_cache.sqlite3 next to the scripts)")
+    scanning.add_argument('--low-memory', action='store_true', help="keep memory use flat on very large trees, spilling positions to temporary files past --memory-budget")
+    scanning.add_argument('--memory-budget', type=int, default=256, metavar='MIB', help="memory budget of --low-memory in MiB (default: %(default)s)")
+    scanning.add_argument('--backend', choices=sorted(POSITION_BACKENDS), default='scan', help="position reader backend (default: %(default)s)")
+    scanning.add_argument('--json-backend', choices=['auto'] + sorted(PARSERS), default='auto', help="JSON parser; auto uses orjson when it is installed (default: %(default)s)")
+
+    output = parser.add_argument_group('output')
+    output.add_argument('--format', choices=sorted(WRITERS), default='jsonl', help="output format (default: %(default)s)")
+    output.add_argument('-o', '--output', help="write results to this file instead of stdout")
+    output.add_argument('--relative', action='store_true', help="print paths relative to the scanned directory")
+    output.add_argument('--progress', action='store_true', help="show a progress bar on stderr")
+    output.add_argument('--stats', action='store_true', help="print stage timings and counters on stderr")
+    output.add_argument('--stats-json', metavar='FILE', help="write the scan statistics as JSON to FILE")
+    output.add_argument('--profile', metavar='FILE', help="run the scan under cProfile and write the profile to FILE")
+    watching = parser.add_argument_group('watching')
+    watching.add_argument('--watch', action='store_true', help="after the scan, keep watching DIRECTORY and print a JSON line whenever a duplicate group forms, grows or goes away")
+    watching.add_argument('--debounce', type=float, default=0.5, help="seconds a changed file must be left alone before it is read (default: %(default)s)")
+    watching.add_argument('--poll', action='store_true', help="poll the directory instead of using inotify")
+    watching.add_argument('--poll-interval', type=float, default=2.0, help="seconds between polls (default: %(default)s)")
+
+    output.add_argument('-q', '--quiet', action='store_true', help="do not print the summary on stderr")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.round_positions and args.decimals is None:
+        build_parser().error("--round-positions requires --decimals")
+    if not os.path.isdir(args.directory):
+        build_parser().error(f"not a directory: {args.directory}")
+    from key_paths import KeyPathError, compile_key_paths
+    try:
+        compile_key_paths((args.key or []) + [args.name_field, args.cleared_field, args.description_field])
+    except KeyPathError as e:
+        build_parser().error(str(e))
+
+    use_backend(args.json_backend)
+    from json_file_manager import find_duplicate_and_near_duplicate_positions
+
+    index = None
+    watcher = None
+    if args.watch:
+        if args.match != 'position':
+            build_parser().error("--watch only works with --match position")
+        from watch import DuplicateWatcher, PositionIndex
+        # The watcher starts before the scan so that files written during the scan are not missed.
+        index = PositionIndex(num_decimals=args.decimals, tolerance=args.tolerance if args.find_similar else None, match_keys=args.key or 'position', ignore_empty=args.ignore_empty)
+        watcher = DuplicateWatcher(args.directory, index, file_pattern=args.pattern or '*.json', exclude_patterns=args.exclude, exclude_dirs=args.exclude_dir, max_depth=args.max_depth, position_backend=args.backend, debounce=args.debounce, poll_interval=args.poll_interval, use_inotify=not args.poll)
+
+    progress_bar = None
+    progress_callback = None
+    if args.progress:
+        from tqdm import tqdm
+
+        def progress_callback(current, total, file_path):
+            nonlocal progress_bar
+            if progress_bar is None:
+                progress_bar = tqdm(total=total, unit='file', file=sys.stderr)
+            progress_bar.total = total
+            progress_bar.update(current - progress_bar.n)
+
+    stats = None
+    if args.stats or args.stats_json or args.profile:
+        from scan_stats import ScanStats
+        stats = ScanStats(profile=bool(args.profile))
+
+    duplicates = set()
+    near_duplicates = set()
+    try:
+        position_to_files, duplicate_positions, near_duplicate_positions, invalid_positions, _ = find_duplicate_and_near_duplicate_positions(
+            args.directory,
+            duplicates,
+            near_duplicates,
+            file_pattern=args.pattern or '*.json',
+            exclude_patterns=args.exclude,
+            exclude_dirs=args.exclude_dir,
+            max_depth=args.max_depth,
+            ignore_empty=args.ignore_empty,
+            num_decimals=args.decimals,
+            update_name=args.write_filename_to_name,
+            remove_description=args.remove_description,
+            clear_name=args.clear_name,
+            round_positions=args.round_positions,
+            find_near_duplicates=args.find_similar,
+            tolerance=args.tolerance,
+            progress_callback=progress_callback,
+            workers=args.workers or None,
+            use_cache=args.cache or args.rebuild_cache or args.cache_path is not None,
+            rebuild_cache=args.rebuild_cache,
+            cache_path=args.cache_path,
+            position_backend=args.backend,
+            match_by=args.match,
+            match_keys=args.key or 'position',
+            name_field=args.name_field,
+            cleared_field=args.cleared_field,
+            description_field=args.description_field,
+            stats=stats,
+            ignore_fields=args.ignore_field,
+            low_memory=args.low_memory,
+            memory_budget=args.memory_budget * 1024 * 1024,
+            output_format='compact' if args.compact else 'indented',
+            fsync=args.fsync,
+            watch_index=index,
+        )
+    finally:
+        if progress_bar is not None:
+            progress_bar.close()
+
+    groups = iter_result_groups(position_to_files, duplicate_positions, near_duplicate_positions, relative_to=args.directory if args.relative else None)
+    if args.output:
+        with open(args.output, 'w', newline='', encoding='utf-8') as stream:
+            group_count = write_groups(groups, stream, args.format)
+    else:
+        try:
+            group_count = write_groups(groups, sys.stdout, args.format)
+        except BrokenPipeError:
+            # The reader went away (e.g. piped into head); stop quietly.
+            sys.stdout = open(os.devnull, 'w')
+            return 1
+
+    if args.stats:
+        print(stats.summary(), file=sys.stderr)
+    if args.stats_json:
+        stats.write_report(args.stats_json)
+    if args.profile:
+        stats.dump_profile(args.profile)
+    if not args.quiet:
+        print(
+            f"{group_count} groups, {len(duplicates)} exact duplicates, {len(near_duplicates)} near duplicates, "
+            f"{len(invalid_positions)} invalid positions",
+            file=sys.stderr,
+        )
+
+    if watcher is not None:
+        if not args.quiet:
+            print(f"Watching {args.directory} for changes, Ctrl+C to stop", file=sys.stderr)
+
+        def print_event(event):
+            if args.relative:
+                event = relative_event(event, args.directory)
+            write_jsonl([event], sys.stdout)
+
+        try:
+            watcher.run(print_event)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import fnmatch
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+# Paths are handed from the enumeration thread to the scan in batches of this size. The listing
+# stops while QUEUED_BATCHES are waiting, so it runs at most that far ahead of the scan.
+BATCH_SIZE = 256
+QUEUED_BATCHES = 64
+
+
+def compile_patterns(patterns):
+    # Returns a matcher for any of the glob patterns (fnmatch syntax), or None when there are none.
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    patterns = [os.path.normcase(pattern) for pattern in patterns if pattern]
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{fnmatch.translate(pattern)})' for pattern in patterns)).match
+
+
+def matches(matcher, name, relative_path):
+    # Patterns match the bare name, or the path relative to the scanned directory ('/' separated),
+    # so both '*.json' and 'archive/*' work.
+    name = os.path.normcase(name)
+    relative_path = os.path.normcase(relative_path)
+    return matcher(name) is not None or matcher(relative_path) is not None
+
+
+class FileEnumerator:
+    # Walks directory_path with os.scandir on a background thread and yields the matching files in
+    # os.walk order, so scanning can start on the first files while the rest of the tree is still
+    # being listed. total is None until the walk has finished; count is the number found so far.
+    # The walk waits while the consumer is QUEUED_BATCHES behind, so memory use does not grow with
+    # the tree; elapsed leaves that waiting out.
+    #
+    # include/exclude are glob patterns for files, exclude_dirs are glob patterns for directories
+    # that are not descended into at all, and max_depth limits how far below directory_path the walk
+    # goes (0 = only the directory itself). With with_stat, (path, stat_result) pairs are yielded,
+    # reusing the stat that scandir already made.
+    def __init__(self, directory_path, include='*.json', exclude=(), exclude_dirs=(), max_depth=None, follow_symlinks=False, with_stat=False):
+        self.directory_path = directory_path
+        self.include = compile_patterns(include)
+        self.exclude = compile_patterns(exclude)
+        self.exclude_dirs = compile_patterns(exclude_dirs)
+        self.max_depth = max_depth
+        self.follow_symlinks = follow_symlinks
+        self.with_stat = with_stat
+        self.count = 0
+        self.total = None
+        self.elapsed = 0.0
+        self.waited = 0.0
+        self.batches = queue.Queue(maxsize=QUEUED_BATCHES)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def close(self):
+        self.stopped.set()
+
+    def __iter__(self):
+        self.start()
+        try:
+            while True:
+                batch = self.batches.get()
+                if batch is None:
+                    return
+                yield from batch
+        finally:
+            self.close()
+
+    def put(self, batch):
+        # Blocks while the queue is full, giving up once close() has been called (the consumer is
+        # gone and nobody will drain it). Returns whether the batch was queued.
+        start = time.perf_counter()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    self.batches.put(batch, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            self.waited += time.perf_counter() - start
+
+    def is_wanted(self, name, relative_path):
+        if self.include is not None and not matches(self.include, name, relative_path):
+            return False
+        return self.exclude is None or not matches(self.exclude, name, relative_path)
+
+    def run(self):
+        batch = []
+        start = time.perf_counter()
+        try:
+            # Directories are visited depth first in listing order with each directory's files
+            # emitted before its subdirectories, like os.walk(topdown=True).
+            stack = [(self.directory_path, '', 0)]
+            while stack and not self.stopped.is_set():
+                directory, relative_directory, depth = stack.pop()
+                try:
+                    with os.scandir(directory) as entries:
+                        entries = list(entries)
+                except OSError as e:
+                    logging.error(f"Error listing directory: {directory} - {str(e)}")
+                    continue
+
+                subdirectories = []
+                for entry in entries:
+                    relative_path = relative_directory + entry.name
+                    try:
+                        is_directory = entry.is_dir()
+                    except OSError:
+                        is_directory = False
+                    if is_directory:
+                        if self.max_depth is not None and depth >= self.max_depth:
+                            continue
+                        if self.exclude_dirs is not None and matches(self.exclude_dirs, entry.name, relative_path):
+                            continue
+                        if not self.follow_symlinks and entry.is_symlink():
+                            continue
+                        subdirectories.append((entry.path, relative_path + '/', depth + 1))
+                    elif self.is_wanted(entry.name, relative_path):
+                        if self.with_stat:
+                            try:
+                                batch.append((entry.path, entry.stat()))
+                            except OSError:
+                                batch.append((entry.path, None))
+                        else:
+                            batch.append(entry.path)
+                        self.count += 1
+                        if len(batch) >= BATCH_SIZE:
+                            if not self.put(batch):
+                                return
+                            batch = []
+                stack.extend(reversed(subdirectories))
+        finally:
+            # total is set before the last batch goes out, so it is known by the time the consumer
+            # reaches the last file.
+            self.elapsed = time.perf_counter() - start - self.waited
+            self.total = self.count
+            if not batch or self.put(batch):
+                self.put(None)
@@ -0,0 +1,300 @@
+import argparse
+import errno
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# A journal is a JSON Lines file: a header, one line per planned operation, then one line per
+# completed operation and finally a completion marker. Completed lines are flushed every
+# JOURNAL_FLUSH_EVERY operations, so after a crash the journal tells which operations may still be
+# pending (resume) and which ones were carried out (undo).
+JOURNAL_VERSION = 1
+JOURNAL_FLUSH_EVERY = 256
+
+
+def unique_destination(destination_path, taken):
+    # Duplicates often share a basename, and earlier moves may have left files of the same name in
+    # the destination folder; such files get a numbered name ("x (2).json") instead.
+    candidate = destination_path
+    root, extension = os.path.splitext(destination_path)
+    number = 2
+    while os.path.normcase(candidate) in taken or os.path.lexists(candidate):
+        candidate = f"{root} ({number}){extension}"
+        number += 1
+    taken.add(os.path.normcase(candidate))
+    return candidate
+
+
+def plan_moves(file_paths, destination_folder, base_directory=None):
+    # With base_directory, paths keep their location relative to it under destination_folder;
+    # otherwise every file lands directly in destination_folder. No two operations share a
+    # destination and none is planned onto an existing file; one that appears after planning is
+    # never replaced either (see move_file).
+    operations = []
+    taken = set()
+    for file_path in file_paths:
+        if base_directory is not None:
+            destination_path = os.path.join(destination_folder, os.path.relpath(file_path, base_directory))
+        else:
+            destination_path = os.path.join(destination_folder, os.path.basename(file_path))
+        operations.append((file_path, unique_destination(destination_path, taken)))
+    return operations
+
+
+def plan_deletes(file_paths):
+    return [(file_path, None) for file_path in file_paths]
+
+
+def destination_exists_error(destination):
+    return FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), destination)
+
+
+def move_file(source, destination):
+    # Renames source to destination on the same device, failing with FileExistsError rather than
+    # replacing a file already at destination. A hard link is created and the source unlinked, so
+    # the check cannot race another writer; a link left by a crash between the two steps is
+    # finished on the next run. Filesystems without hard links fall back to checking first.
+    try:
+        os.link(source, destination, follow_symlinks=False)
+    except FileExistsError:
+        if not os.path.samestat(os.lstat(source), os.lstat(destination)):
+            raise
+    except (OSError, NotImplementedError):
+        if os.path.lexists(destination):
+            raise destination_exists_error(destination)
+        os.rename(source, destination)
+        return
+    os.unlink(source)
+
+
+def copy_move_file(source, destination):
+    # Moves source to a destination on another device without replacing a file already there: the
+    # destination is created exclusively and removed again if the copy fails.
+    if os.path.islink(source):
+        os.symlink(os.readlink(source), destination)
+        os.unlink(source)
+        return
+    with open(source, 'rb') as source_file:
+        try:
+            destination_file = open(destination, 'xb')
+        except FileExistsError:
+            raise destination_exists_error(destination)
+        try:
+            with destination_file:
+                shutil.copyfileobj(source_file, destination_file, 1024 * 1024)
+            shutil.copystat(source, destination)
+        except BaseException:
+            try:
+                os.remove(destination)
+            except OSError:
+                pass
+            raise
+    os.unlink(source)
+
+
+class BatchResult:
+    def __init__(self):
+        self.completed = []
+        self.failed = {}
+        self.bytes_processed = 0
+        self.elapsed = 0.0
+
+    @property
+    def files_per_second(self):
+        return len(self.completed) / self.elapsed if self.elapsed > 0 else 0
+
+
+class FileOperationBatch:
+    # Moves (destination given) or deletes (destination None) a batch of files.
+    #
+    # Destination directories are created once up front. Moves within a filesystem are a rename
+    # (move_file) on this thread; moves that have to copy across devices run on a thread pool
+    # (copy_move_file). Neither replaces an existing file: such moves fail with FileExistsError and
+    # are left out of the journal, so undo never puts the wrong file back.
+    # progress_callback(done, total, bytes_processed, elapsed) is called from the thread running the
+    # batch. control may be any object with a checkpoint() method (such as
+    # json_file_manager.ScanControl); whatever it raises stops the batch, leaving the journal
+    # resumable.
+    def __init__(self, operations, journal_path=None, progress_callback=None, workers=8, control=None):
+        self.operations = list(operations)
+        self.journal_path = journal_path
+        self.progress_callback = progress_callback
+        self.workers = workers
+        self.control = control
+        self.journal = None
+        self.unflushed = 0
+
+    def write_journal_header(self, completed_indices=()):
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        self.journal = open(self.journal_path, 'w', encoding='utf-8')
+        self.journal.write(json.dumps({'version': JOURNAL_VERSION, 'created': time.time()}) + '\n')
+        self.journal.writelines(
+            json.dumps({'index': index, 'source': source, 'destination': destination}) + '\n'
+            for index, (source, destination) in enumerate(self.operations)
+        )
+        self.journal.writelines(json.dumps({'done': index}) + '\n' for index in completed_indices)
+        self.journal.flush()
+
+    def record_done(self, index):
+        if self.journal is None:
+            return
+        self.journal.write(json.dumps({'done': index}) + '\n')
+        self.unflushed += 1
+        if self.unflushed >= JOURNAL_FLUSH_EVERY:
+            self.journal.flush()
+            self.unflushed = 0
+
+    def create_destination_directories(self):
+        directories = {os.path.dirname(destination) for _, destination in self.operations if destination is not None}
+        for directory in directories:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    def run(self, completed_indices=()):
+        result = BatchResult()
+        start = time.perf_counter()
+        completed_indices = set(completed_indices)
+        if self.journal_path is not None:
+            self.write_journal_header(sorted(completed_indices))
+
+        total = len(self.operations)
+        done = len(completed_indices)
+        last_report = 0.0
+
+        def report(force=False):
+            nonlocal last_report
+            now = time.perf_counter()
+            if self.progress_callback and (force or now - last_report >= 0.05):
+                last_report = now
+                self.progress_callback(done, total, result.bytes_processed, now - start)
+
+        def finished(index, source, size, error=None):
+            nonlocal done
+            done += 1
+            if error is None:
+                result.completed.append(source)
+                result.bytes_processed += size
+                self.record_done(index)
+            else:
+                result.failed[source] = error
+            report()
+
+        try:
+            self.create_destination_directories()
+            same_device = {}
+            cross_device = []
+            for index, (source, destination) in enumerate(self.operations):
+                if index in completed_indices:
+                    continue
+                if self.control is not None:
+                    self.control.checkpoint()
+                try:
+                    size = os.stat(source).st_size
+                    if destination is None:
+                        os.remove(source)
+                    else:
+                        directories = (os.path.dirname(source) or '.', os.path.dirname(destination) or '.')
+                        if directories not in same_device:
+                            same_device[directories] = os.stat(directories[0]).st_dev == os.stat(directories[1]).st_dev
+                        if not same_device[directories]:
+                            cross_device.append((index, source, destination, size))
+                            continue
+                        move_file(source, destination)
+                except OSError as e:
+                    finished(index, source, 0, e)
+                    continue
+                finished(index, source, size)
+
+            if cross_device:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    futures = [(index, source, size, executor.submit(copy_move_file, source, destination)) for index, source, destination, size in cross_device]
+                    for index, source, size, future in futures:
+                        if self.control is not None:
+                            self.control.checkpoint()
+                        try:
+                            future.result()
+                        except OSError as e:
+                            finished(index, source, 0, e)
+                            continue
+                        finished(index, source, size)
+
+            if self.journal is not None:
+                self.journal.write(json.dumps({'complete': True}) + '\n')
+        finally:
+            result.elapsed = time.perf_counter() - start
+            report(force=True)
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+        return result
+
+
+def read_journal(journal_path):
+    # Returns (operations, completed indices, whether the batch finished).
+    operations = {}
+    completed = set()
+    complete = False
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a torn last line.
+                continue
+            if 'index' in entry:
+                operations[entry['index']] = (entry['source'], entry['destination'])
+            elif 'done' in entry:
+                completed.add(entry['done'])
+            elif entry.get('complete'):
+                complete = True
+    return [operations[index] for index in sorted(operations)], completed, complete
+
+
+def resume_journal(journal_path, progress_callback=None, workers=8, control=None):
+    operations, completed, _ = read_journal(journal_path)
+    for index, (source, destination) in enumerate(operations):
+        # Operations that happened right before a crash may not have made it into the journal.
+        if index not in completed and not os.path.exists(source) and (destination is None or os.path.exists(destination)):
+            completed.add(index)
+    batch = FileOperationBatch(operations, journal_path, progress_callback=progress_callback, workers=workers, control=control)
+    return batch.run(completed)
+
+
+def undo_journal(journal_path, progress_callback=None, workers=8, control=None, undo_journal_path=None):
+    # Moves files back to where they came from. Deletes cannot be undone and are skipped.
+    operations, completed, _ = read_journal(journal_path)
+    reverse = []
+    for index, (source, destination) in enumerate(operations):
+        if destination is None:
+            continue
+        if index in completed or (os.path.exists(destination) and not os.path.exists(source)):
+            reverse.append((destination, source))
+    batch = FileOperationBatch(reverse, undo_journal_path, progress_callback=progress_callback, workers=workers, control=control)
+    return batch.run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resume or undo a journaled batch of file moves/deletes.")
+    parser.add_argument('action', choices=['status', 'resume', 'undo'])
+    parser.add_argument('journal', help="journal file written by a batch")
+    args = parser.parse_args(argv)
+
+    operations, completed, complete = read_journal(args.journal)
+    if args.action == 'status':
+        print(f"{len(completed)}/{len(operations)} operations done{' (complete)' if complete else ''}")
+        return 0
+    if args.action == 'resume':
+        result = resume_journal(args.journal)
+    else:
+        result = undo_journal(args.journal, undo_journal_path=args.journal + '.undo')
+    print(f"{len(result.completed)} files processed, {len(result.failed)} failed in {result.elapsed:.2f} seconds")
+    for file_path, error in result.failed.items():
+        print(f"  {file_path}: {error}", file=sys.stderr)
+    return 1 if result.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,39 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from json_file_manager import find_duplicate_and_near_duplicate_positions
 import os
 import threading
+import queue
 import time
-import shutil
 import glob
+import fnmatch
+import logging
+
+# The same error.log json_file_manager logs to; it is only imported once a scan starts, so without
+# this, errors from loading the preferences would go to stderr.
+logging.basicConfig(filename='error.log', level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def select_directory():
     directory = filedialog.askdirectory()
     directory_entry.delete(0, tk.END)
     directory_entry.insert(tk.END, directory)
 
+# How often the main loop drains the scan queue, and how often the scan thread posts progress.
+POLL_INTERVAL_MS = 100
+PROGRESS_INTERVAL = 0.05
+# Group rows are added to the results tree in batches so a huge result set does not block the window.
+GROUP_ROWS_PER_TICK = 500
+# Confirmation dialogs list at most this many files.
+CONFIRM_LIST_LIMIT = 25
+# "Match By" choices and the match_by value each one passes to the scan.
+MATCH_MODES = {"Position": "position", "File Content": "content", "Normalized Content": "normalized"}
+# Move/delete journals, for resuming or undoing a batch with file_operations.py.
+JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "journals")
+
+scan_queue = queue.Queue()
+scan_control = None
+
 def process_files():
+    global scan_control
     directory = directory_entry.get()
     if not directory:
         messagebox.showwarning("Warning", "Please select a directory.")
@@ -23,43 +44,188 @@ def process_files():
         'write_filename_to_name': write_filename_to_name_var.get(),
         'remove_description': remove_description_var.get(),
         'round_positions': round_positions_var.get(),
-        'round_to_decimal': int(round_to_decimal_entry.get()) if round_positions_var.get() else None
+        'round_to_decimal': int(round_to_decimal_entry.get()) if round_positions_var.get() else None,
+        'cleared_field': clear_field_entry.get().strip() or "name",
+        'name_field': name_field_entry.get().strip() or "name",
+        'description_field': description_field_entry.get().strip() or "description"
     }
 
     duplicate_options = {
         'find_exact_duplicates': find_exact_duplicates_var.get(),
         'find_similar_matches': find_similar_matches_var.get(),
-        'similarity_threshold': float(similarity_threshold_entry.get()) if find_similar_matches_var.get() else None
+        'similarity_threshold': float(similarity_threshold_entry.get()) if find_similar_matches_var.get() else None,
+        'use_scan_cache': use_scan_cache_var.get(),
+        'low_memory': low_memory_var.get(),
+        'match_by': MATCH_MODES[match_by_combobox.get()],
+        'ignore_fields': [field.strip() for field in ignore_fields_entry.get().split(",") if field.strip()],
+        'match_keys': [key.strip() for key in match_keys_entry.get().split(",") if key.strip()] or ["position"]
+    }
+
+    scan_options = {
+        'num_decimals': clean_options['round_to_decimal'],
+        'update_name': clean_options['write_filename_to_name'],
+        'remove_description': clean_options['remove_description'],
+        'clear_name': clean_options['clear_name'],
+        'round_positions': clean_options['round_positions'],
+        'find_near_duplicates': duplicate_options['find_similar_matches'],
+        'tolerance': duplicate_options['similarity_threshold'],
+        'use_cache': duplicate_options['use_scan_cache'],
+        'low_memory': duplicate_options['low_memory'],
+        'match_by': duplicate_options['match_by'],
+        'ignore_fields': duplicate_options['ignore_fields'],
+        'match_keys': duplicate_options['match_keys'],
+        'cleared_field': clean_options['cleared_field'],
+        'name_field': clean_options['name_field'],
+        'description_field': clean_options['description_field']
     }
 
-    progress_bar.pack()
-    progress_bar.start()
+    # Imported here so the window comes up without waiting for NumPy and the scanning modules.
+    from json_file_manager import ScanControl
+    from preferences import save_preferences
+    from key_paths import KeyPathError, compile_key_paths
+
+    try:
+        compile_key_paths(scan_options['match_keys'] + [scan_options['cleared_field'], scan_options['name_field'], scan_options['description_field']])
+    except KeyPathError as e:
+        messagebox.showwarning("Warning", str(e))
+        return
+
+    try:
+        save_preferences(collect_preferences())
+    except OSError as e:
+        logging.error(f"Error saving preferences: {str(e)}")
+
+    scan_control = ScanControl()
+    progress_bar["value"] = 0
+    progress_bar.pack(fill=tk.X)
+    matches_label.config(text="Scanning...")
+    start_button.config(state=tk.DISABLED)
+    pause_button.config(state=tk.NORMAL, text="Pause")
+    cancel_button.config(state=tk.NORMAL)
 
     start_time = time.time()
+    thread = threading.Thread(target=run_scan, args=(directory, scan_options, scan_control), daemon=True)
+    thread.start()
+    window.after(POLL_INTERVAL_MS, poll_scan_queue, directory, start_time)
+
+def preference_widgets():
+    # Widgets whose state is saved in preferences.json, by preference name.
+    return {
+        'directory': directory_entry,
+        'clear_name': clear_name_var,
+        'cleared_field': clear_field_entry,
+        'write_filename_to_name': write_filename_to_name_var,
+        'name_field': name_field_entry,
+        'remove_description': remove_description_var,
+        'description_field': description_field_entry,
+        'round_positions': round_positions_var,
+        'round_to_decimal': round_to_decimal_entry,
+        'find_exact_duplicates': find_exact_duplicates_var,
+        'find_similar_matches': find_similar_matches_var,
+        'similarity_threshold': similarity_threshold_entry,
+        'match_keys': match_keys_entry,
+        'match_by': match_by_combobox,
+        'ignore_fields': ignore_fields_entry,
+        'use_scan_cache': use_scan_cache_var,
+        'low_memory': low_memory_var,
+    }
+
+def collect_preferences():
+    return {name: widget.get() for name, widget in preference_widgets().items()}
+
+def apply_preferences():
+    from preferences import load_preferences
+
+    preferences = load_preferences() or {}
+    for name, widget in preference_widgets().items():
+        if name not in preferences:
+            continue
+        value = preferences[name]
+        if isinstance(widget, ttk.Combobox):
+            if value in widget["values"]:
+                widget.set(value)
+        elif isinstance(widget, tk.Entry):
+            widget.delete(0, tk.END)
+            widget.insert(tk.END, str(value))
+        else:
+            widget.set(bool(value))
+
+def run_scan(directory, scan_options, control):
+    # Runs on the scan thread: it never touches Tk, it only posts messages for poll_scan_queue.
+    from json_file_manager import find_duplicate_and_near_duplicate_positions, ScanCancelled
+    from scan_stats import ScanStats
+
+    last_post = 0
+
+    def progress_callback(current, total, file_path):
+        nonlocal last_post
+        now = time.monotonic()
+        if now - last_post >= PROGRESS_INTERVAL or current == total:
+            last_post = now
+            scan_queue.put(("progress", current, total, file_path))
 
     duplicates = set()
     near_duplicates = set()
-    duplicate_positions = set()
-    near_duplicate_positions = set()
-
-    position_to_files, duplicate_positions, near_duplicate_positions, invalid_positions, filenames_within_group = find_duplicate_and_near_duplicate_positions(
-        directory,
-        duplicates,
-        near_duplicates,
-        num_decimals=clean_options['round_to_decimal'],
-        update_name=clean_options['write_filename_to_name'],
-        remove_description=clean_options['remove_description'],
-        clear_name=clean_options['clear_name'],
-        round_positions=clean_options['round_positions'],
-        find_near_duplicates=duplicate_options['find_similar_matches'],
-        tolerance=duplicate_options['similarity_threshold'],
-        progress_callback=lambda current, total, file_path: update_progress(current, total, file_path, duplicate_positions, near_duplicate_positions)
-    )
-    end_time = time.time()
+    stats = ScanStats()
+    try:
+        results = find_duplicate_and_near_duplicate_positions(directory, duplicates, near_duplicates, progress_callback=progress_callback, control=control, stats=stats, **scan_options)
+        scan_queue.put(("done", results, stats))
+    except ScanCancelled:
+        scan_queue.put(("cancelled",))
+    except Exception as e:
+        scan_queue.put(("error", str(e)))
+
+def poll_scan_queue(directory, start_time):
+    latest_progress = None
+    finished = None
+    while True:
+        try:
+            message = scan_queue.get_nowait()
+        except queue.Empty:
+            break
+        if message[0] == "progress":
+            latest_progress = message
+        else:
+            finished = message
+
+    if latest_progress is not None:
+        update_progress(*latest_progress[1:], directory)
+    if finished is None:
+        window.after(POLL_INTERVAL_MS, poll_scan_queue, directory, start_time)
+        return
 
-    progress_bar.stop()
+    end_time = time.time()
     progress_bar.pack_forget()
-
+    start_button.config(state=tk.NORMAL)
+    pause_button.config(state=tk.DISABLED, text="Pause")
+    cancel_button.config(state=tk.DISABLED)
+
+    if finished[0] == "cancelled":
+        matches_label.config(text="Scan cancelled")
+        messagebox.showinfo("Scan Cancelled", "The scan was cancelled.")
+    elif finished[0] == "error":
+        matches_label.config(text="Scan failed")
+        messagebox.showerror("Scan Failed", f"The scan stopped with an error:\n\n{finished[1]}")
+    else:
+        position_to_files, duplicate_positions, near_duplicate_positions, invalid_positions, filenames_within_group = finished[1]
+        matches_label.config(text=f"{len(duplicate_positions) + len(near_duplicate_positions)} Matches Found")
+        show_results(directory, position_to_files, duplicate_positions, near_duplicate_positions, end_time - start_time, finished[2])
+
+def toggle_pause():
+    if scan_control is None:
+        return
+    if scan_control.paused:
+        scan_control.resume()
+        pause_button.config(text="Pause")
+    else:
+        scan_control.pause()
+        pause_button.config(text="Resume")
+
+def cancel_scan():
+    if scan_control is not None:
+        scan_control.cancel()
+
+def show_results(directory, position_to_files, duplicate_positions, near_duplicate_positions, elapsed_time, stats=None):
     duplicate_window = tk.Toplevel(window)
     duplicate_window.title("Duplicate JSON Files")
     duplicate_window.geometry("800x600")
@@ -68,78 +234,246 @@ def process_files():
     duplicate_frame = tk.Frame(duplicate_window)
     duplicate_frame.pack(fill=tk.BOTH, expand=True, pady=10, padx=10)
 
-    duplicate_listbox = tk.Listbox(duplicate_frame, selectmode=tk.MULTIPLE, width=100, height=20)
-    duplicate_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    duplicate_tree = ttk.Treeview(duplicate_frame, columns=("files",), selectmode="extended")
+    duplicate_tree.heading("#0", text="Position / File", anchor="w")
+    duplicate_tree.heading("files", text="Files")
+    duplicate_tree.column("#0", width=600)
+    duplicate_tree.column("files", width=140, stretch=False, anchor="e")
+    duplicate_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
     scrollbar = tk.Scrollbar(duplicate_frame)
     scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
-    duplicate_listbox.config(yscrollcommand=scrollbar.set)
-    scrollbar.config(command=duplicate_listbox.yview)
-
-    for position in duplicate_positions:
-        for file_path in position_to_files[position]:
-            duplicate_listbox.insert(tk.END, os.path.relpath(file_path, directory))
-        duplicate_listbox.insert(tk.END, "")  # Add a blank line between groups
-
-    for position in near_duplicate_positions:
-        for file_path in position_to_files[position]:
-            duplicate_listbox.insert(tk.END, os.path.relpath(file_path, directory))
-        duplicate_listbox.insert(tk.END, "")  # Add a blank line between groups
+    duplicate_tree.config(yscrollcommand=scrollbar.set)
+    scrollbar.config(command=duplicate_tree.yview)
+
+    # The result set lives in these dicts; the tree only gets a row per group up front, and file rows
+    # are created when a group is expanded. Marked files are the selection, including files in groups
+    # that have not been expanded yet.
+    groups = {}
+    group_of_path = {}
+    path_to_item = {}
+    item_to_path = {}
+    marked = set()
+
+    for position, file_paths in position_to_files.items():
+        exact = position in duplicate_positions
+        near = position in near_duplicate_positions
+        if not (exact or near):
+            continue
+        group_id = f"group{len(groups)}"
+        kind = "exact + near" if exact and near else "exact" if exact else "near"
+        groups[group_id] = {"position": position, "kind": kind, "files": dict.fromkeys(file_paths), "loaded": False}
+        for file_path in file_paths:
+            group_of_path[file_path] = group_id
+
+    def group_summary(group_id):
+        files = groups[group_id]["files"]
+        marked_count = sum(1 for file_path in files if file_path in marked)
+        return f"{len(files)} files, {marked_count} marked" if marked_count else f"{len(files)} files"
+
+    def refresh_groups(group_ids):
+        for group_id in group_ids:
+            if duplicate_tree.exists(group_id):
+                duplicate_tree.item(group_id, values=(group_summary(group_id),))
+
+    group_ids = list(groups)
+
+    def insert_group_rows(start=0):
+        if not duplicate_window.winfo_exists():
+            return
+        for group_id in group_ids[start:start + GROUP_ROWS_PER_TICK]:
+            group = groups[group_id]
+            duplicate_tree.insert("", tk.END, iid=group_id, text=f"{group['position']}  ({group['kind']})", values=(group_summary(group_id),))
+            duplicate_tree.insert(group_id, tk.END, iid=f"{group_id}:placeholder", text="Loading...")
+        if start + GROUP_ROWS_PER_TICK < len(group_ids):
+            duplicate_window.after(1, insert_group_rows, start + GROUP_ROWS_PER_TICK)
+
+    def load_group(group_id):
+        group = groups.get(group_id)
+        if group is None or group["loaded"]:
+            return
+        group["loaded"] = True
+        duplicate_tree.delete(f"{group_id}:placeholder")
+        for file_path in group["files"]:
+            item = duplicate_tree.insert(group_id, tk.END, text=os.path.relpath(file_path, directory))
+            path_to_item[file_path] = item
+            item_to_path[item] = file_path
+        marked_items = [path_to_item[file_path] for file_path in group["files"] if file_path in marked]
+        if marked_items:
+            duplicate_tree.selection_add(marked_items)
+
+    def on_group_open(event):
+        load_group(duplicate_tree.focus())
+
+    def on_selection_change(event):
+        # Only rows that exist in the tree can change through the selection.
+        selected = {item_to_path[item] for item in duplicate_tree.selection() if item in item_to_path}
+        changed = [file_path for file_path in path_to_item if (file_path in selected) != (file_path in marked)]
+        for file_path in changed:
+            if file_path in selected:
+                marked.add(file_path)
+            else:
+                marked.discard(file_path)
+        refresh_groups({group_of_path[file_path] for file_path in changed})
+
+    duplicate_tree.bind("<<TreeviewOpen>>", on_group_open)
+    duplicate_tree.bind("<<TreeviewSelect>>", on_selection_change)
+    insert_group_rows()
+
+    def set_marked(new_marked):
+        changed = marked.symmetric_difference(new_marked)
+        marked.clear()
+        marked.update(new_marked)
+        duplicate_tree.selection_set([path_to_item[file_path] for file_path in marked if file_path in path_to_item])
+        refresh_groups({group_of_path[file_path] for file_path in changed})
+
+    def remove_files(file_paths):
+        items = []
+        changed_groups = set()
+        for file_path in file_paths:
+            group_id = group_of_path.pop(file_path, None)
+            if group_id is None:
+                continue
+            del groups[group_id]["files"][file_path]
+            changed_groups.add(group_id)
+            marked.discard(file_path)
+            item = path_to_item.pop(file_path, None)
+            if item is not None:
+                del item_to_path[item]
+                items.append(item)
+        if items:
+            duplicate_tree.delete(*items)
+        refresh_groups(changed_groups)
+
+    def describe_selection(action):
+        selected_files = [file_path for file_path in group_of_path if file_path in marked]
+        emptied_groups = sum(1 for group in groups.values() if group["files"] and all(file_path in marked for file_path in group["files"]))
+        confirm_message = f"Are you sure you want to {action} the following {len(selected_files)} files?\n\n"
+        confirm_message += "\n".join(os.path.relpath(file, directory) for file in selected_files[:CONFIRM_LIST_LIMIT])
+        if len(selected_files) > CONFIRM_LIST_LIMIT:
+            confirm_message += f"\n... and {len(selected_files) - CONFIRM_LIST_LIMIT} more"
+        if emptied_groups:
+            confirm_message += f"\n\nWarning: {emptied_groups} groups will have no files left."
+        return selected_files, confirm_message
 
     def auto_select_files(directory):
         auto_select_dir = auto_select_entry.get()
         if auto_select_dir:
-            selected_indices = []
-            for index, result_file in enumerate(duplicate_listbox.get(0, tk.END)):
-                if result_file:
-                    if result_file.startswith(auto_select_dir):
-                        selected_indices.append(index)
-
-            duplicate_listbox.selection_clear(0, tk.END)  # Clear any previous selection
-            for index in selected_indices:
-                duplicate_listbox.selection_set(index)
-                duplicate_listbox.itemconfig(index, bg='lightblue')
+            if any(character in auto_select_dir for character in "*?["):
+                matches = lambda relative_path: fnmatch.fnmatch(relative_path, auto_select_dir) or fnmatch.fnmatch(relative_path, os.path.join(auto_select_dir, "*"))
+            else:
+                matches = lambda relative_path: relative_path.startswith(auto_select_dir)
+            set_marked({file_path for file_path in group_of_path if matches(os.path.relpath(file_path, directory))})
+
+    def keep_one_per_group():
+        # Marks every file except the first one found in each group.
+        set_marked({file_path for group in groups.values() for file_path in list(group["files"])[1:]})
+
+    def run_file_batch(operations, action, journal_name, on_complete=None):
+        # The batch runs on a worker thread; progress comes back through batch_queue and is drained
+        # by poll_file_batch on the main loop, like a scan.
+        from file_operations import FileOperationBatch
+
+        batch_queue = queue.Queue()
+        last_post = 0
+
+        def progress_callback(done, total, bytes_processed, elapsed):
+            nonlocal last_post
+            now = time.monotonic()
+            if now - last_post >= PROGRESS_INTERVAL or done == total:
+                last_post = now
+                batch_queue.put(("progress", done, total, elapsed))
+
+        def run_batch():
+            try:
+                batch = FileOperationBatch(operations, os.path.join(JOURNAL_DIR, journal_name), progress_callback=progress_callback)
+                batch_queue.put(("done", batch.run()))
+            except Exception as e:
+                batch_queue.put(("error", str(e)))
+
+        def poll_file_batch():
+            latest_progress = None
+            finished = None
+            while True:
+                try:
+                    message = batch_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if message[0] == "progress":
+                    latest_progress = message
+                else:
+                    finished = message
+            if latest_progress is not None:
+                _, done, total, elapsed = latest_progress
+                rate = done / elapsed if elapsed > 0 else 0
+                batch_status_label.config(text=f"{action}: {done}/{total} files ({rate:.0f} files/s)")
+            if finished is None:
+                duplicate_window.after(POLL_INTERVAL_MS, poll_file_batch)
+                return
+
+            set_batch_buttons(tk.NORMAL)
+            if finished[0] == "error":
+                batch_status_label.config(text=f"{action} failed")
+                messagebox.showerror(f"{action} Failed", f"The batch stopped with an error:\n\n{finished[1]}")
+                return
+            result = finished[1]
+            if on_complete is not None:
+                on_complete(result)
+            batch_status_label.config(text=f"{action}: {len(result.completed)} files in {result.elapsed:.2f} seconds ({result.files_per_second:.0f} files/s)")
+            message = f"{len(result.completed)} files processed in {result.elapsed:.2f} seconds."
+            if result.failed:
+                message += f"\n\n{len(result.failed)} files failed:\n"
+                message += "\n".join(f"{os.path.relpath(file_path, directory)}: {error.strerror or error}" for file_path, error in list(result.failed.items())[:CONFIRM_LIST_LIMIT])
+            messagebox.showinfo(f"{action} Complete", message)
+
+        set_batch_buttons(tk.DISABLED)
+        batch_status_label.config(text=f"{action}: starting...")
+        threading.Thread(target=run_batch, daemon=True).start()
+        duplicate_window.after(POLL_INTERVAL_MS, poll_file_batch)
+
+    def set_batch_buttons(state):
+        for button in (delete_button, move_button, undo_move_button):
+            button.config(state=state)
+        if state == tk.NORMAL and last_move_journal is None:
+            undo_move_button.config(state=tk.DISABLED)
 
     def delete_selected_files():
-        selected_indices = duplicate_listbox.curselection()
-        selected_files = [duplicate_listbox.get(index) for index in selected_indices]
-        selected_files = [os.path.join(directory, file) for file in selected_files]
-        confirm_message = "Are you sure you want to delete the following files?\n\n"
-        confirm_message += "\n".join(os.path.relpath(file, directory) for file in selected_files)
+        selected_files, confirm_message = describe_selection("delete")
+        if not selected_files:
+            return
         confirm = messagebox.askyesno("Confirm Deletion", confirm_message)
         if confirm:
-            for file_path in selected_files:
-                try:
-                    os.remove(file_path)
-                    duplicate_listbox.delete(duplicate_listbox.get(0, tk.END).index(os.path.relpath(file_path, directory)))
-                except FileNotFoundError:
-                    pass
-            messagebox.showinfo("Deletion Complete", "Selected files have been deleted.")
+            from file_operations import plan_deletes
+            run_file_batch(plan_deletes(selected_files), "Deletion", f"delete-{time.strftime('%Y%m%d-%H%M%S')}.jsonl", lambda result: remove_files(result.completed))
 
     def move_selected_files():
-        selected_indices = duplicate_listbox.curselection()
-        selected_files = [duplicate_listbox.get(index) for index in selected_indices]
-        selected_files = [os.path.join(directory, file) for file in selected_files]
+        nonlocal last_move_journal
+        selected_files, confirm_message = describe_selection("move")
+        if not selected_files:
+            return
         destination_folder = filedialog.askdirectory(title="Select Destination Folder")
         if destination_folder:
-            confirm_message = "Are you sure you want to move the following files?\n\n"
-            confirm_message += "\n".join(os.path.relpath(file, directory) for file in selected_files)
             confirm = messagebox.askyesno("Confirm Move", confirm_message)
             if confirm:
-                for file_path in selected_files:
-                    try:
-                        if preserve_directory_tree_var.get():
-                            relative_path = os.path.relpath(file_path, directory)
-                            destination_path = os.path.join(destination_folder, relative_path)
-                            os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-                        else:
-                            destination_path = os.path.join(destination_folder, os.path.basename(file_path))
-                        shutil.move(file_path, destination_path)
-                        duplicate_listbox.delete(duplicate_listbox.get(0, tk.END).index(os.path.relpath(file_path, directory)))
-                    except FileNotFoundError:
-                        pass
-                messagebox.showinfo("Move Complete", "Selected files have been moved.")
+                from file_operations import plan_moves
+                operations = plan_moves(selected_files, destination_folder, base_directory=directory if preserve_directory_tree_var.get() else None)
+                last_move_journal = f"move-{time.strftime('%Y%m%d-%H%M%S')}.jsonl"
+                run_file_batch(operations, "Move", last_move_journal, lambda result: remove_files(result.completed))
+
+    def undo_last_move():
+        nonlocal last_move_journal
+        if last_move_journal is None:
+            return
+        from file_operations import read_journal
+        operations, completed, _ = read_journal(os.path.join(JOURNAL_DIR, last_move_journal))
+        if not messagebox.askyesno("Confirm Undo", f"Move {len(completed)} files back to where they came from?\n\nThey will not reappear in this list until the next scan."):
+            return
+        reverse = [(destination, source) for index, (source, destination) in enumerate(operations) if index in completed]
+        last_move_journal = None
+        run_file_batch(reverse, "Undo Move", f"undo-{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+
+    last_move_journal = None
 
     action_frame = tk.Frame(duplicate_window)
     action_frame.pack(pady=10)
@@ -154,6 +488,12 @@ def process_files():
     move_button = tk.Button(action_frame, text="Move Selected Files", command=move_selected_files)
     move_button.pack(side=tk.LEFT)
 
+    undo_move_button = tk.Button(action_frame, text="Undo Last Move", command=undo_last_move, state=tk.DISABLED)
+    undo_move_button.pack(side=tk.LEFT, padx=5)
+
+    batch_status_label = tk.Label(duplicate_window, text="")
+    batch_status_label.pack()
+
     auto_select_frame = tk.Frame(duplicate_window)
     auto_select_frame.pack(pady=10)
 
@@ -166,9 +506,24 @@ def process_files():
     auto_select_button = tk.Button(auto_select_frame, text="Select", command=lambda: auto_select_files(directory))
     auto_select_button.pack(side=tk.LEFT)
 
+    keep_one_button = tk.Button(auto_select_frame, text="Keep One Per Group", command=keep_one_per_group)
+    keep_one_button.pack(side=tk.LEFT, padx=5)
+
+    clear_selection_button = tk.Button(auto_select_frame, text="Clear Selection", command=lambda: set_marked(set()))
+    clear_selection_button.pack(side=tk.LEFT)
+
     def save_results():
-        file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text Files", "*.txt"), ("All Files", "*.*")])
-        if file_path:
+        file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text Files", "*.txt"), ("JSON Lines", "*.jsonl"), ("CSV", "*.csv"), ("All Files", "*.*")])
+        if file_path and os.path.splitext(file_path)[1].lower() in (".jsonl", ".csv"):
+            from cli import iter_result_groups, write_groups
+            try:
+                with open(file_path, "w", newline="", encoding="utf-8") as file:
+                    groups = iter_result_groups(position_to_files, duplicate_positions, near_duplicate_positions, relative_to=directory)
+                    write_groups(groups, file, os.path.splitext(file_path)[1].lower().lstrip("."))
+                messagebox.showinfo("Save Results", "Results saved successfully.")
+            except IOError:
+                messagebox.showerror("Save Results", "An error occurred while saving the results.")
+        elif file_path:
             try:
                 with open(file_path, "w", encoding="utf-8") as file:
                     file.write("Exact Duplicate Positions:\n")
@@ -191,12 +546,27 @@ def process_files():
             except IOError:
                 messagebox.showerror("Save Results", "An error occurred while saving the results.")
 
-    save_button = tk.Button(duplicate_window, text="Save Results", command=save_results)
-    save_button.pack(pady=10)
+    def save_report():
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON Files", "*.json"), ("All Files", "*.*")])
+        if file_path:
+            try:
+                stats.write_report(file_path)
+                messagebox.showinfo("Save Scan Report", "Scan report saved successfully.")
+            except IOError:
+                messagebox.showerror("Save Scan Report", "An error occurred while saving the scan report.")
+
+    save_frame = tk.Frame(duplicate_window)
+    save_frame.pack(pady=10)
+
+    save_button = tk.Button(save_frame, text="Save Results", command=save_results)
+    save_button.pack(side=tk.LEFT, padx=5)
+
+    if stats is not None:
+        save_report_button = tk.Button(save_frame, text="Save Scan Report", command=save_report)
+        save_report_button.pack(side=tk.LEFT, padx=5)
 
     total_matches = len(duplicate_positions) + len(near_duplicate_positions)
     total_files = progress_bar["maximum"]
-    elapsed_time = end_time - start_time
     files_per_second = total_files / elapsed_time if elapsed_time > 0 else 0
 
     result_message = f"Process completed.\n\n"
@@ -206,26 +576,32 @@ def process_files():
     result_message += f"Total files scanned: {total_files}\n"
     result_message += f"Files per second: {files_per_second:.2f}\n"
     result_message += f"Elapsed time: {elapsed_time:.2f} seconds\n\n"
+    if stats is not None:
+        result_message += stats.summary() + "\n\n"
     result_message += "Duplicate and near duplicate files are listed in the new window."
 
     messagebox.showinfo("Results", result_message)
 
-def update_progress(current, total, file_path, duplicate_positions, near_duplicate_positions):
+def update_progress(current, total, file_path, directory):
+    current_file_label.config(text=f"Current File: {os.path.relpath(file_path, directory)}", anchor="w")
+    if total is None:
+        # Still listing files, so the total is not known yet.
+        progress_bar["maximum"] = current * 2
+        progress_bar["value"] = current
+        files_scanned_label.config(text=f"{current} Files Scanned (finding files...)")
+        return
+
     progress_bar["value"] = current
     progress_bar["maximum"] = total
-    current_file_label.config(text=f"Current File: {os.path.relpath(file_path, directory_entry.get())}", anchor="w")
 
-    total_matches = len(duplicate_positions) + len(near_duplicate_positions)
     completion_percentage = (current / total) * 100 if total > 0 else 0
 
-    matches_label.config(text=f"{total_matches} Matches Found")
+    if current == total:
+        matches_label.config(text="Grouping positions...")
     files_scanned_label.config(text=f"{current}/{total} Files Scanned ({completion_percentage:.2f}%)")
 
-    window.update_idletasks()
-
 def start_process():
-    thread = threading.Thread(target=process_files)
-    thread.start()
+    process_files()
 
 # Create the main window
 window = tk.Tk()
@@ -249,17 +625,39 @@ browse_button.pack(side=tk.LEFT)
 cleaning_frame = tk.LabelFrame(window, text="Cleaning Options")
 cleaning_frame.pack(pady=10, padx=10, fill=tk.BOTH)
 
+# Each field option takes a key path, e.g. "name" or "meta.label".
+clear_name_frame = tk.Frame(cleaning_frame)
+clear_name_frame.pack(anchor=tk.W)
+
 clear_name_var = tk.BooleanVar()
-clear_name_checkbox = tk.Checkbutton(cleaning_frame, text="Clear Name Field", variable=clear_name_var)
-clear_name_checkbox.pack(anchor=tk.W)
+clear_name_checkbox = tk.Checkbutton(clear_name_frame, text="Clear Field:", variable=clear_name_var)
+clear_name_checkbox.pack(side=tk.LEFT)
+
+clear_field_entry = tk.Entry(clear_name_frame, width=20)
+clear_field_entry.insert(tk.END, "name")
+clear_field_entry.pack(side=tk.LEFT)
+
+write_filename_to_name_frame = tk.Frame(cleaning_frame)
+write_filename_to_name_frame.pack(anchor=tk.W)
 
 write_filename_to_name_var = tk.BooleanVar()
-write_filename_to_name_checkbox = tk.Checkbutton(cleaning_frame, text="Write Filename to Name Field", variable=write_filename_to_name_var)
-write_filename_to_name_checkbox.pack(anchor=tk.W)
+write_filename_to_name_checkbox = tk.Checkbutton(write_filename_to_name_frame, text="Write Filename to Field:", variable=write_filename_to_name_var)
+write_filename_to_name_checkbox.pack(side=tk.LEFT)
+
+name_field_entry = tk.Entry(write_filename_to_name_frame, width=20)
+name_field_entry.insert(tk.END, "name")
+name_field_entry.pack(side=tk.LEFT)
+
+remove_description_frame = tk.Frame(cleaning_frame)
+remove_description_frame.pack(anchor=tk.W)
 
 remove_description_var = tk.BooleanVar()
-remove_description_checkbox = tk.Checkbutton(cleaning_frame, text="Remove Description Field", variable=remove_description_var)
-remove_description_checkbox.pack(anchor=tk.W)
+remove_description_checkbox = tk.Checkbutton(remove_description_frame, text="Remove Field:", variable=remove_description_var)
+remove_description_checkbox.pack(side=tk.LEFT)
+
+description_field_entry = tk.Entry(remove_description_frame, width=20)
+description_field_entry.insert(tk.END, "description")
+description_field_entry.pack(side=tk.LEFT)
 
 round_positions_var = tk.BooleanVar()
 round_positions_checkbox = tk.Checkbutton(cleaning_frame, text="Round Positional Data", variable=round_positions_var)
@@ -297,6 +695,40 @@ similarity_threshold_entry = tk.Entry(similarity_threshold_frame, width=5)
 similarity_threshold_entry.insert(tk.END, "0.9")
 similarity_threshold_entry.pack(side=tk.LEFT)
 
+match_keys_frame = tk.Frame(duplicate_frame)
+match_keys_frame.pack(anchor=tk.W)
+
+match_keys_label = tk.Label(match_keys_frame, text="Match Keys:")
+match_keys_label.pack(side=tk.LEFT)
+
+match_keys_entry = tk.Entry(match_keys_frame, width=35)
+match_keys_entry.insert(tk.END, "position")
+match_keys_entry.pack(side=tk.LEFT, padx=5)
+
+match_by_frame = tk.Frame(duplicate_frame)
+match_by_frame.pack(anchor=tk.W)
+
+match_by_label = tk.Label(match_by_frame, text="Match By:")
+match_by_label.pack(side=tk.LEFT)
+
+match_by_combobox = ttk.Combobox(match_by_frame, values=list(MATCH_MODES), state="readonly", width=18)
+match_by_combobox.set("Position")
+match_by_combobox.pack(side=tk.LEFT, padx=5)
+
+ignore_fields_label = tk.Label(match_by_frame, text="Ignore Fields:")
+ignore_fields_label.pack(side=tk.LEFT)
+
+ignore_fields_entry = tk.Entry(match_by_frame, width=15)
+ignore_fields_entry.pack(side=tk.LEFT)
+
+use_scan_cache_var = tk.BooleanVar()
+use_scan_cache_checkbox = tk.Checkbutton(duplicate_frame, text="Use Scan Cache (skip unchanged files)", variable=use_scan_cache_var)
+use_scan_cache_checkbox.pack(anchor=tk.W)
+
+low_memory_var = tk.BooleanVar()
+low_memory_checkbox = tk.Checkbutton(duplicate_frame, text="Low Memory Mode (for very large folders)", variable=low_memory_var)
+low_memory_checkbox.pack(anchor=tk.W)
+
 # Progress bar
 progress_frame = tk.Frame(window)
 progress_frame.pack(fill=tk.X, padx=10, pady=5)
@@ -313,9 +745,21 @@ matches_label.pack(side=tk.LEFT)
 files_scanned_label = tk.Label(progress_frame, text="0/0 Files Scanned (0.00%)")
 files_scanned_label.pack(side=tk.RIGHT)
 
-# Start button
-start_button = tk.Button(window, text="Begin!", command=start_process)
-start_button.pack(pady=10)
+# Start, pause and cancel buttons
+control_frame = tk.Frame(window)
+control_frame.pack(pady=10)
+
+start_button = tk.Button(control_frame, text="Begin!", command=start_process)
+start_button.pack(side=tk.LEFT, padx=5)
+
+pause_button = tk.Button(control_frame, text="Pause", command=toggle_pause, state=tk.DISABLED)
+pause_button.pack(side=tk.LEFT, padx=5)
+
+cancel_button = tk.Button(control_frame, text="Cancel", command=cancel_scan, state=tk.DISABLED)
+cancel_button.pack(side=tk.LEFT, padx=5)
+
+# Restore the options from the last scan once the window is up
+window.after(1, apply_preferences)
 
 # Run the GUI
 window.mainloop()
\ No newline at end of file
@@ -0,0 +1,55 @@
+import json
+import logging
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Parsing goes through the fastest installed parser. Files are always written with json (see
+# write_back.serialize): orjson formats floats and non-ASCII text differently and only indents by
+# two spaces, so writing with it would rewrite files that did not change. canonical_json stays on
+# json as well, so content hashes do not depend on the backend.
+#
+# The JSON_BACKEND environment variable ('json', 'orjson' or 'auto') picks the parser; worker
+# processes inherit it.
+
+
+def _orjson_loads(data):
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # orjson is stricter than json (NaN and Infinity, integers wider than 64 bits, a byte order
+        # mark, lone surrogates). Such files are still read as json reads them, and broken ones
+        # raise json's error.
+        return json.loads(data)
+
+
+PARSERS = {'json': json.loads}
+if orjson is not None:
+    PARSERS['orjson'] = _orjson_loads
+
+
+def select_parser(name=None):
+    name = name or os.environ.get('JSON_BACKEND') or 'auto'
+    if name == 'auto':
+        return 'orjson' if 'orjson' in PARSERS else 'json'
+    if name not in PARSERS:
+        logging.warning(f"JSON backend {name!r} is not available, using the default")
+        return select_parser('auto')
+    return name
+
+
+BACKEND = select_parser()
+loads = PARSERS[BACKEND]
+
+
+def use_backend(name):
+    # Switches the parser of this process and, through JSON_BACKEND, of worker processes started
+    # afterwards. Callers look up json_backend.loads when they parse, so this takes effect at once.
+    global BACKEND, loads
+    BACKEND = select_parser(name)
+    loads = PARSERS[BACKEND]
+    os.environ['JSON_BACKEND'] = BACKEND
+    return BACKEND
@@ -1,167 +1,1060 @@
 import json
 import os
+import math
+import gc
+import hashlib
 import logging
-from collections import defaultdict
+import itertools
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from array import array
+from collections import defaultdict, deque
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 from tqdm import tqdm
+from scan_cache import ScanCache
+from file_enumerator import FileEnumerator
+from position_reader import read_position
+from key_paths import compile_key_path, compile_key_paths, split_match_key
+from scan_stats import FileTimer, NULL_TIMER
+# Preferences used to live here; they are still importable from this module.
+from preferences import load_preferences, save_preferences
+from write_back import WriteBack
+import json_backend
 import numpy as np
 import glob
 
-invalid_positions = set()
+# Files are hashed in blocks of this size in content matching mode.
+HASH_BLOCK_SIZE = 1024 * 1024
+# Memory budget of a low-memory scan, in bytes, and how many files a spilled block is spread over.
+LOW_MEMORY_BUDGET = 256 * 1024 * 1024
+SPILL_BUCKETS = 64
+# Near-duplicate grids are built on at most this many axes: a lookup visits 3 ** axes cells, so
+# compound keys with many axes are only filtered on the rest.
+GRID_AXES = 3
+# Past this many candidate pairs of neighbouring keys, near duplicates are matched one key at a time.
+NEAR_PAIR_LIMIT = 50_000_000
 
 logging.basicConfig(filename='error.log', level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def extract_positions(file_path):
+def read_json_file(file_path, timer=NULL_TIMER):
+    # Returns the file's raw bytes, which go to the parser undecoded, and the parsed data.
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    timer.lap('read')
+    timer.bytes_read += len(raw)
+    data = json_backend.loads(raw)
+    timer.lap('parse')
+    return raw, data
+
+# Rewritten files go through a WriteBack: indented as always, replaced atomically, and not written
+# at all when the text is unchanged.
+DEFAULT_WRITE_BACK = WriteBack()
+
+def write_json_file(file_path, data, original_text=None, write_back=None):
+    return (write_back or DEFAULT_WRITE_BACK).write(file_path, data, original_text)
+
+# Match keys are one or more compiled key paths (see key_paths). The default 'position' key is read
+# as a position tuple, as it always was; for any other keys the raw values are returned and
+# split_match_key decides which of them are coordinates.
+DEFAULT_MATCH_KEYS = compile_key_paths('position')
+
+def position_from_data(data, match_keys=DEFAULT_MATCH_KEYS):
+    if match_keys != DEFAULT_MATCH_KEYS:
+        values = tuple(key_path.get(data) for key_path in match_keys)
+        return values if all(value is not None for value in values) else None
+    position = data.get('position')
+    if position:
+        return tuple(position)
+    return None
+
+def extract_positions(file_path, backend='scan', match_keys=DEFAULT_MATCH_KEYS, timer=NULL_TIMER):
     try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            position = data.get('position')
+        if match_keys == DEFAULT_MATCH_KEYS:
+            position = read_position(file_path, backend, timer=timer)
             if position:
                 return tuple(position)
+        elif len(match_keys) == 1 and isinstance(match_keys[0].head, str):
+            # The backend only decodes the first key; the rest of the path is walked from there.
+            value = match_keys[0].get_below_head(read_position(file_path, backend, match_keys[0].head, timer))
+            if value is not None:
+                return (value,)
+        else:
+            _, data = read_json_file(file_path, timer)
+            return position_from_data(data, match_keys)
     except (json.JSONDecodeError, FileNotFoundError) as e:
         logging.error(f"Error processing file: {file_path} - {str(e)}")
+        timer.error = type(e).__name__
     return None
 
-def round_position(position, num_decimals, file_path):
+def round_position(position, num_decimals, file_path, invalid_positions=None):
+    # Files whose position cannot be rounded are added to invalid_positions, if given.
     if position is None:
-        invalid_positions.add(file_path)
+        if invalid_positions is not None:
+            invalid_positions.add(file_path)
         return None
     elif isinstance(position, (tuple, list)):
         return tuple(round(float(x), num_decimals) for x in position)
     else:
-        invalid_positions.add(file_path)
+        if invalid_positions is not None:
+            invalid_positions.add(file_path)
         logging.warning(f"Invalid position format: {position} in file: {file_path}")
         return None
 
-def update_name_field(file_path):
-    filename = os.path.basename(file_path)
-    name, _ = os.path.splitext(filename)
+# Field operations take the loaded data and the file path, modify the data in place and return
+# whether anything changed. They are module-level functions (bound with partial) so that they can
+# be sent to worker processes. field is a key path, either compiled or as a string.
 
-    try:
-        with open(file_path, 'r+') as f:
-            data = json.load(f)
-            data['name'] = name
-            f.seek(0)
-            json.dump(data, f, indent=4)
-            f.truncate()
-    except (json.JSONDecodeError, FileNotFoundError) as e:
-        logging.error(f"Error updating name field in file: {file_path} - {str(e)}")
+MISSING = object()
 
-def remove_description(file_path):
-    try:
-        with open(file_path, 'r+') as f:
-            data = json.load(f)
-            if 'description' in data:
-                del data['description']  # Remove 'description'
-                f.seek(0)
-                json.dump(data, f, indent=4)
-                f.truncate()
-                print(f"Description removed from file: {file_path}")  # Conditional print
-            else:
-                print(f"No description found in file: {file_path}")  # Conditional print
-    except (json.JSONDecodeError, FileNotFoundError) as e:
-        logging.error(f"Error processing file: {file_path} - {str(e)}")
+def write_filename_to_field(data, file_path, field='name'):
+    key_path = compile_key_path(field) if isinstance(field, str) else field
+    name, _ = os.path.splitext(os.path.basename(file_path))
+    return key_path.set(data, name)
 
-def clear_name_value(file_path):
+def delete_field(data, file_path, field='description'):
+    key_path = compile_key_path(field) if isinstance(field, str) else field
+    return key_path.delete(data)
+
+def clear_field(data, file_path, field='name'):
+    key_path = compile_key_path(field) if isinstance(field, str) else field
+    value = key_path.get(data, MISSING)
+    if value is MISSING or value == '':
+        return False
+    return key_path.set(data, '')
+
+def round_field(data, file_path, num_decimals=None, field='position'):
+    key_path = compile_key_path(field) if isinstance(field, str) else field
+    position = key_path.get(data)
+    if not position:
+        return False
+    rounded_position = round_position(position, num_decimals, file_path)
+    if rounded_position is None or list(rounded_position) == position:
+        return False
+    return key_path.set(data, list(rounded_position))
+
+def apply_operations(data, file_path, operations):
+    changed = False
+    for operation in operations:
+        changed = operation(data, file_path) or changed
+    return changed
+
+def transform_file(file_path, operations, write_back=None):
+    # Loads the file once, applies every operation in order and writes it back only if it changed.
     try:
-        with open(file_path, 'r+') as f:
-            data = json.load(f)
-            if 'name' in data:
-                data['name'] = ''  # Set to an empty string
-                f.seek(0)
-                json.dump(data, f, indent=4)
-                f.truncate()
-    except (json.JSONDecodeError, FileNotFoundError) as e:
+        text, data = read_json_file(file_path)
+        if apply_operations(data, file_path, operations):
+            return write_json_file(file_path, data, text, write_back)
+    except (json.JSONDecodeError, OSError) as e:
         logging.error(f"Error processing file: {file_path} - {str(e)}")
+    return False
 
-def round_positions_in_file(file_path, num_decimals):
+class PathTable:
+    # File paths of a low-memory scan. Each path is kept as the id of its (interned) directory plus
+    # its basename, and the basenames are packed into one bytearray, so a file costs the length of
+    # its name and a few bytes of index rather than a str object of its own.
+    def __init__(self):
+        self.directories = []
+        self.directory_ids = {}
+        self.directory_of = array('i')
+        self.names = bytearray()
+        self.name_ends = array('q')
+        self.directory_bytes = 0
+
+    def __len__(self):
+        return len(self.directory_of)
+
+    @property
+    def nbytes(self):
+        # Rough size in memory, including the interned directories.
+        return len(self.names) + 12 * len(self.name_ends) + self.directory_bytes
+
+    def append(self, file_path):
+        # Split after the last separator rather than with os.path.split, which drops repeated
+        # separators, so joining the parts gives back exactly the path that was added.
+        cut = max(file_path.rfind('/'), file_path.rfind(os.sep)) + 1
+        directory = file_path[:cut]
+        directory_id = self.directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = self.directory_ids[directory] = len(self.directories)
+            self.directories.append(directory)
+            self.directory_bytes += 2 * len(directory) + 100
+        self.directory_of.append(directory_id)
+        self.names += file_path[cut:].encode('utf-8', 'surrogateescape')
+        self.name_ends.append(len(self.names))
+
+    def __getitem__(self, index):
+        start = self.name_ends[index - 1] if index > 0 else 0
+        return self.directories[self.directory_of[index]] + self.names[start:self.name_ends[index]].decode('utf-8', 'surrogateescape')
+
+class PathGroup(Sequence):
+    # The files of a group found by a low-memory scan: an integer array of indices into the scan's
+    # PathTable. Paths are only built when the group is read.
+    __slots__ = ('paths', 'indices')
+
+    def __init__(self, paths, indices):
+        self.paths = paths
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.paths[i] for i in self.indices[index].tolist()]
+        return self.paths[int(self.indices[index])]
+
+    def __iter__(self):
+        return map(self.paths.__getitem__, self.indices.tolist())
+
+    def __repr__(self):
+        return f"PathGroup({list(self)!r})"
+
+def spill_dtype(dims):
+    return np.dtype([('row', '<i8'), ('position', '<f8', (dims,))])
+
+def spill_buckets(rounded):
+    # Bucket of every (rounded) row, from a hash of its bits. Adding 0.0 turns -0.0 into 0.0, as the
+    # two compare equal.
+    bits = np.ascontiguousarray(rounded + 0.0).view(np.uint64)
+    hashes = np.zeros(len(rounded), dtype=np.uint64)
+    for column in bits.T:
+        hashes = (hashes ^ column) * np.uint64(0x9E3779B97F4A7C15)
+    return (hashes >> np.uint64(32)) % np.uint64(SPILL_BUCKETS)
+
+class PositionStore:
+    # Positions collected by a scan, kept columnar: one contiguous float64 block per partition and
+    # dimensionality plus, for every row, the index of its file in paths (the order files were
+    # scanned in). The partition holds the non-numeric parts of a compound match key; positions in
+    # different partitions are never grouped together.
+    #
+    # With low_memory, paths is a PathTable, and whenever the store outgrows memory_budget bytes the
+    # blocks are rounded to num_decimals and spilled to temporary files, SPILL_BUCKETS per block, by
+    # a hash of the rounded position. Equal positions always end up in the same file, so exact
+    # duplicates can be found one file at a time. close() removes the files.
+    def __init__(self, low_memory=False, memory_budget=LOW_MEMORY_BUDGET, num_decimals=None):
+        self.paths = PathTable() if low_memory else []
+        self.low_memory = low_memory
+        self.memory_budget = memory_budget
+        self.num_decimals = num_decimals
+        self.blocks = {}
+        self.rows = {}
+        self.block_bytes = 0
+        self.spill_directory = None
+        self.spilled = {}
+        self.spill_count = 0
+        self.remove_spill_directory = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, file_path, position, partition=()):
+        coordinates = [float(x) for x in position]
+        block_key = (partition, len(coordinates))
+        if block_key not in self.blocks:
+            self.blocks[block_key] = array('d')
+            self.rows[block_key] = array('q')
+        self.blocks[block_key].extend(coordinates)
+        self.rows[block_key].append(len(self.paths))
+        self.paths.append(file_path)
+        if self.low_memory and self.memory_budget is not None:
+            self.block_bytes += 8 * (len(coordinates) + 1)
+            # However large the paths get, a reasonable share of the budget is kept for the blocks
+            # so the spills do not become tiny.
+            if self.block_bytes > max(self.memory_budget - self.paths.nbytes, self.memory_budget // 16):
+                self.spill()
+
+    def block_arrays(self, block_key, rounded=False):
+        partition, dims = block_key
+        rows = np.frombuffer(self.rows[block_key], dtype=np.int64)
+        return np.frombuffer(self.blocks[block_key], dtype=np.float64).reshape(len(rows), dims), rows, rounded
+
+    def spill_path(self, block_number, bucket):
+        return os.path.join(self.spill_directory, f'{block_number}-{bucket}.bin')
+
+    def spill(self):
+        if self.spill_directory is None:
+            self.spill_directory = tempfile.mkdtemp(prefix='json_scan_')
+            # Also removes the files if the scan stops before close() is called.
+            self.remove_spill_directory = weakref.finalize(self, shutil.rmtree, self.spill_directory, True)
+        for block_key in self.blocks:
+            coordinates, rows, _ = self.block_arrays(block_key)
+            records = np.empty(len(rows), dtype=spill_dtype(block_key[1]))
+            records['row'] = rows
+            records['position'] = round_array(coordinates, self.num_decimals) if self.num_decimals is not None else coordinates
+            buckets = spill_buckets(records['position'])
+            block_number, spilled_buckets = self.spilled.setdefault(block_key, (len(self.spilled), set()))
+            order = np.argsort(buckets, kind='stable')
+            boundaries = np.flatnonzero(np.diff(buckets[order])) + 1
+            for start, end in zip([0] + boundaries.tolist(), boundaries.tolist() + [len(order)]):
+                bucket = int(buckets[order[start]])
+                with open(self.spill_path(block_number, bucket), 'ab') as f:
+                    records[order[start:end]].tofile(f)
+                spilled_buckets.add(bucket)
+        self.blocks = {}
+        self.rows = {}
+        self.block_bytes = 0
+        self.spill_count += 1
+
+    def load_spilled(self, block_number, bucket, dims):
+        records = np.fromfile(self.spill_path(block_number, bucket), dtype=spill_dtype(dims))
+        return np.ascontiguousarray(records['position']), np.ascontiguousarray(records['row']), True
+
+    def block_count(self):
+        return len(self.spilled) if self.spilled else len(self.blocks)
+
+    def grouping_blocks(self):
+        # Yields (partition, chunks) per block; a chunk is a function returning (positions, file
+        # indices, whether the positions are rounded already). A block held in memory is a single
+        # chunk, a spilled block has one chunk per bucket file.
+        if not self.spilled:
+            for block_key in self.blocks:
+                yield block_key[0], [partial(self.block_arrays, block_key)]
+            return
+        if self.blocks:
+            self.spill()
+        for (partition, dims), (block_number, buckets) in self.spilled.items():
+            yield partition, [partial(self.load_spilled, block_number, bucket, dims) for bucket in sorted(buckets)]
+
+    def close(self):
+        if self.remove_spill_directory is not None:
+            self.remove_spill_directory()
+
+def round_array(values, num_decimals):
+    # np.round scales, rounds and unscales, which can land on the other side of a tie than Python's
+    # correctly rounded round(). Values close to a tie (or too large to scale exactly) are redone
+    # with round() so the results always match round_position.
+    rounded = np.round(values, num_decimals)
+    scaled = values * 10.0 ** num_decimals
+    suspicious = ~(np.abs(scaled) < 2.0 ** 52) | (np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for index in np.flatnonzero(suspicious):
+        rounded.flat[index] = round(float(values.flat[index]), num_decimals)
+    return rounded
+
+def near_pairs(keys, codes, multipliers, tolerance, limit=NEAR_PAIR_LIMIT):
+    # Every pair (i, j) of keys with j < i that lie in the same or neighbouring grid cells and within
+    # tolerance on every axis, sorted by i and then j. Keys are matched against the keys in each
+    # neighbouring cell with array operations, in slices of about a million candidate pairs. Returns
+    # None past limit candidate pairs (keys packed so densely that nearly everything is a neighbour).
+    # Keys are visited in cell order, which keeps the neighbour searches sorted and cache friendly.
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    key_numbers = order
+    pair_firsts = []
+    pair_seconds = []
+    candidate_count = 0
+    # The three neighbouring cells along the first axis have consecutive codes, so they are searched
+    # as one range.
+    for offset in itertools.product((-1, 0, 1), repeat=len(multipliers) - 1):
+        neighbours = sorted_codes + int(np.dot(offset, multipliers[1:]))
+        starts = np.searchsorted(sorted_codes, neighbours - 1, 'left')
+        counts = np.searchsorted(sorted_codes, neighbours + 1, 'right') - starts
+        candidate_count += int(counts.sum())
+        if candidate_count > limit:
+            return None
+        ends = np.cumsum(counts)
+        slice_bounds = np.searchsorted(ends, np.arange(0, ends[-1], 1 << 20), 'right').tolist() + [len(keys)]
+        for low, high in zip(slice_bounds, slice_bounds[1:]):
+            slice_counts = counts[low:high]
+            firsts = np.repeat(key_numbers[low:high], slice_counts)
+            within = np.arange(len(firsts)) - np.repeat(np.cumsum(slice_counts) - slice_counts, slice_counts)
+            seconds = order[np.repeat(starts[low:high], slice_counts) + within]
+            earlier = seconds < firsts
+            firsts, seconds = firsts[earlier], seconds[earlier]
+            close = np.all(np.abs(keys[firsts] - keys[seconds]) <= tolerance, axis=1)
+            pair_firsts.append(firsts[close])
+            pair_seconds.append(seconds[close])
+    firsts = np.concatenate(pair_firsts)
+    seconds = np.concatenate(pair_seconds)
+    pair_order = np.lexsort((seconds, firsts))
+    return firsts[pair_order], seconds[pair_order]
+
+def resolve_near_pairs(representatives, firsts, seconds, max_rounds=64):
+    # Applies the first-match rule to the pairs from near_pairs: a key joins the earliest key near
+    # it that starts a group, and starts a group itself if there is none. A key is decided once
+    # every key before its first group-starting neighbour is known not to start a group, so each
+    # round decides at least the earliest undecided key; chains of near keys are short, and
+    # whatever is left after max_rounds is finished one key at a time.
+    if not len(firsts):
+        return representatives
+    segment_starts = np.flatnonzero(np.r_[True, firsts[1:] != firsts[:-1]])
+    segment_keys = firsts[segment_starts]
+    # 1 starts a group, 0 joins one, -1 not decided yet.
+    status = np.ones(len(representatives), dtype=np.int8)
+    status[segment_keys] = -1
+    pair_numbers = np.arange(len(seconds))
+    undecided = np.arange(len(segment_keys))
+    for _ in range(max_rounds):
+        if not len(undecided):
+            return representatives
+        partner_status = status[seconds]
+        first_open = np.minimum.reduceat(np.where(partner_status != 0, pair_numbers, len(seconds)), segment_starts)[undecided]
+        keys = segment_keys[undecided]
+        starts_group = first_open == len(seconds)
+        first_open = np.minimum(first_open, len(seconds) - 1)
+        joins = ~starts_group & (partner_status[first_open] == 1)
+        status[keys[starts_group]] = 1
+        status[keys[joins]] = 0
+        representatives[keys[joins]] = seconds[first_open[joins]]
+        undecided = undecided[~(starts_group | joins)]
+    segment_ends = np.r_[segment_starts[1:], len(seconds)]
+    for segment in undecided.tolist():
+        key = int(segment_keys[segment])
+        for partner in seconds[segment_starts[segment]:segment_ends[segment]].tolist():
+            if status[partner] == 1:
+                status[key] = 0
+                representatives[key] = partner
+                break
+        else:
+            status[key] = 1
+    return representatives
+
+def near_duplicate_representatives(keys, tolerance):
+    # keys holds distinct positions in the order they were first seen. Returns, for each of them, the
+    # index of the key whose group it joins (itself if it starts a group), following the same
+    # first-match rule as PositionGridIndex. The pairs of near keys are found with array operations
+    # on numbered grid cells (see near_pairs); grids that cannot be numbered, and keys packed too
+    # densely for that, go through a PositionGridIndex one key at a time instead.
+    representatives = np.arange(len(keys))
+    if len(keys) < 2 or not tolerance or tolerance <= 0:
+        return representatives
+
+    cells = np.floor(keys / (tolerance * (1 + 1e-9)))
+    # Grid on the axes that spread the keys over the most cells.
+    grid_axes = None
+    if keys.shape[1] > GRID_AXES:
+        spreads = [len(np.unique(cells[:, axis])) for axis in range(keys.shape[1])]
+        grid_axes = sorted(sorted(range(keys.shape[1]), key=lambda axis: -spreads[axis])[:GRID_AXES])
+        cells = cells[:, grid_axes]
+    if np.all(np.isfinite(cells)):
+        # Number the cells (with a margin of one on every side) so neighbour lookups are integer
+        # searches. Grids too large to number in 63 bits go through the index.
+        low = cells.min(axis=0) - 1
+        spans = (cells.max(axis=0) - low + 2).astype(np.int64).tolist()
+        if math.prod(spans) < 2 ** 62:
+            multipliers = np.cumprod([1] + spans[:-1]).astype(np.int64)
+            codes = (cells - low).astype(np.int64) @ multipliers
+            pairs = near_pairs(keys, codes, multipliers, tolerance)
+            if pairs is not None:
+                return resolve_near_pairs(representatives, *pairs)
+
+    position_index = PositionGridIndex(tolerance, grid_axes)
+    key_indices = {}
+    for key_index, key in enumerate(keys.tolist()):
+        key = tuple(key)
+        existing_position = position_index.find(key)
+        if existing_position is None:
+            position_index.add(key)
+            key_indices[key] = key_index
+        else:
+            representatives[key_index] = key_indices[existing_position]
+    return representatives
+
+def group_positions(store, num_decimals=None, find_near_duplicates=False, tolerance=1, stats=None):
+    # Building the result dicts allocates a few objects per file; collector passes over them are
+    # pure overhead, so the collector is paused while grouping.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
     try:
-        with open(file_path, 'r+') as f:
-            data = json.load(f)
-            position = data.get('position')
-            if position:
-                rounded_position = round_position(position, num_decimals, file_path)
-                if rounded_position is not None:
-                    data['position'] = list(rounded_position)
-                    f.seek(0)
-                    json.dump(data, f, indent=4)
-                    f.truncate()
-    except (json.JSONDecodeError, FileNotFoundError) as e:
-        logging.error(f"Error processing file: {file_path} - {str(e)}")
+        return _group_positions(store, num_decimals, find_near_duplicates, tolerance, stats)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
 
-def find_duplicate_and_near_duplicate_positions(directory_path, duplicates, near_duplicates, file_pattern='*.json', ignore_empty=False, num_decimals=None, update_name=False, remove_description=False, clear_name=False, round_positions=False, find_near_duplicates=False, tolerance=1, progress_callback=None):
+def row_codes(rounded):
+    # One integer per row that sorts like the row itself: each column is replaced by the rank of its
+    # value, and the ranks are combined. Sorting these is quicker than a lexsort over the float
+    # columns. Returns None when the ranks do not fit in 63 bits, for rows without coordinates, and
+    # when there are NaNs (which never equal anything, so every NaN row is a position of its own).
+    if not rounded.shape[1] or np.isnan(rounded).any():
+        return None
+    codes = np.zeros(len(rounded), dtype=np.int64)
+    combinations = 1
+    for column in rounded.T:
+        values, ranks = np.unique(column, return_inverse=True)
+        combinations *= len(values)
+        if combinations >= 2 ** 63:
+            return None
+        codes = codes * len(values) + ranks.reshape(-1)
+    return codes
+
+def distinct_positions(rounded):
+    # Distinct rows via a lexicographic sort; the sort is stable, so the first row of every run is
+    # where that position was first seen. A block without coordinates (a key made only of
+    # non-numeric values) is a single run. Returns the distinct positions numbered in the order they
+    # were first seen, the row each of them was first seen in and, for every row, its number.
+    codes = row_codes(rounded)
+    starts_run = np.ones(len(rounded), dtype=bool)
+    if codes is not None:
+        sorted_rows = np.argsort(codes, kind='stable')
+        sorted_codes = codes[sorted_rows]
+        starts_run[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    else:
+        sorted_rows = np.lexsort(rounded.T[::-1]) if rounded.shape[1] else np.arange(len(rounded))
+        sorted_values = rounded[sorted_rows]
+        starts_run[1:] = np.any(sorted_values[1:] != sorted_values[:-1], axis=1)
+    unique_of_row = np.empty(len(sorted_rows), dtype=np.int64)
+    unique_of_row[sorted_rows] = np.cumsum(starts_run) - 1
+    first_rows = sorted_rows[starts_run]
+    keys = rounded[first_rows]
+    order = np.argsort(first_rows, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return keys[order], first_rows[order], rank[unique_of_row]
+
+def _group_positions(store, num_decimals, find_near_duplicates, tolerance, stats=None):
+    # Batch equivalent of matching files one by one as they are scanned: exact groups come from
+    # sorting the (rounded) rows, near-duplicate matching runs once per distinct position.
+    # Returns position_to_files, duplicate_positions, near_duplicate_positions and the sets of
+    # duplicate and near-duplicate file paths. For a low-memory store, position_to_files only holds
+    # the positions shared by more than one file, each with its files as a PathGroup.
+    paths = store.paths
     position_to_files = defaultdict(list)
+    groups = []
     duplicate_positions = set()
     near_duplicate_positions = set()
+    duplicate_rows = []
+    near_duplicate_rows = []
+    several_blocks = store.block_count() > 1
 
-    filenames_within_group = defaultdict(set)
+    def rounded_chunk(load):
+        coordinates, file_indices, is_rounded = load()
+        if num_decimals is None or is_rounded:
+            return coordinates, file_indices
+        start = time.perf_counter()
+        rounded = round_array(coordinates, num_decimals)
+        if stats is not None:
+            stats.add_stage_time('rounding', time.perf_counter() - start)
+        return rounded, file_indices
 
-    file_list = []
-    for root, _, files in os.walk(directory_path):
-        for filename in files:
-            if filename.endswith(file_pattern.split('*')[-1]):
-                file_path = os.path.join(root, filename)
-                file_list.append(file_path)
+    for partition, chunks in store.grouping_blocks():
+        # The distinct positions of every chunk. The chunks of a spilled block never share a
+        # position, so together they are the distinct positions of the block; they are numbered in
+        # the order they were first seen across all of them.
+        distinct = []
+        for load in chunks:
+            rounded, file_indices = rounded_chunk(load)
+            keys, first_rows, unique_of_row = distinct_positions(rounded)
+            sizes = np.bincount(unique_of_row, minlength=len(keys))
+            # A single chunk is kept for the second pass below; spilled chunks are read again.
+            kept = (file_indices, unique_of_row) if len(chunks) == 1 else None
+            distinct.append((keys, file_indices[first_rows], sizes, kept))
+        keys = np.concatenate([chunk[0] for chunk in distinct])
+        first_files = np.concatenate([chunk[1] for chunk in distinct])
+        order = np.argsort(first_files, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        keys, first_files = keys[order], first_files[order]
+        offsets = np.cumsum([0] + [len(chunk[0]) for chunk in distinct])
+
+        if find_near_duplicates and keys.shape[1]:
+            start = time.perf_counter()
+            representatives = near_duplicate_representatives(keys, tolerance)
+            if stats is not None:
+                stats.add_stage_time('near_duplicates', time.perf_counter() - start)
+        else:
+            representatives = np.arange(len(keys))
+        if store.low_memory:
+            sizes = np.concatenate([chunk[2] for chunk in distinct])[order]
+            shared = np.bincount(representatives, weights=sizes, minlength=len(keys)) > 1
+
+        member_files = []
+        member_groups = []
+        duplicate_groups = []
+        near_duplicate_groups = []
+        for chunk_number, (load, chunk) in enumerate(zip(chunks, distinct)):
+            if chunk[3] is not None:
+                file_indices, unique_of_row = chunk[3]
+            else:
+                rounded, file_indices = rounded_chunk(load)
+                unique_of_row = distinct_positions(rounded)[2]
+            unique_of_row = rank[unique_of_row + offsets[chunk_number]]
+            group_of_row = representatives[unique_of_row]
+            is_near = group_of_row != unique_of_row
+            is_duplicate = ~is_near & (file_indices != first_files[unique_of_row])
+            duplicate_groups.append(group_of_row[is_duplicate])
+            near_duplicate_groups.append(group_of_row[is_near])
+            duplicate_rows.append(file_indices[is_duplicate])
+            near_duplicate_rows.append(file_indices[is_near])
+            if store.low_memory:
+                is_shared = shared[group_of_row]
+                file_indices, group_of_row = file_indices[is_shared], group_of_row[is_shared]
+            member_files.append(file_indices)
+            member_groups.append(group_of_row)
 
-    total_files = len(file_list)
-    for index, file_path in enumerate(file_list, start=1):
+        def key_tuples(group_ids):
+            key_list = map(tuple, keys[group_ids].tolist())
+            return [partition + key for key in key_list] if partition else list(key_list)
+
+        duplicate_positions.update(key_tuples(np.unique(np.concatenate(duplicate_groups))))
+        near_duplicate_positions.update(key_tuples(np.unique(np.concatenate(near_duplicate_groups))))
+
+        file_indices = np.concatenate(member_files)
+        group_of_row = np.concatenate(member_groups)
+        if len(chunks) > 1:
+            by_file = np.argsort(file_indices)
+            file_indices, group_of_row = file_indices[by_file], group_of_row[by_file]
+        if not len(file_indices):
+            continue
+        # Group members in file order, groups in the order their first file was seen.
+        row_order = np.argsort(group_of_row, kind='stable')
+        boundaries = np.flatnonzero(np.diff(group_of_row[row_order])) + 1
+        group_starts = np.concatenate(([0], boundaries)).tolist()
+        group_ends = boundaries.tolist() + [len(row_order)]
+        member_indices = file_indices[row_order]
+        group_keys = key_tuples(group_of_row[row_order][group_starts])
+        if store.low_memory:
+            group_members = (PathGroup(paths, member_indices[start:end]) for start, end in zip(group_starts, group_ends))
+        else:
+            member_paths = [paths[i] for i in member_indices.tolist()]
+            group_members = map(member_paths.__getitem__, map(slice, group_starts, group_ends))
+        if several_blocks:
+            group_first_files = member_indices[group_starts].tolist()
+            groups.extend(zip(group_first_files, group_keys, group_members))
+        else:
+            position_to_files.update(zip(group_keys, group_members))
+
+    if groups:
+        groups.sort(key=lambda group: group[0])
+        position_to_files.update((key, members) for _, key, members in groups)
+    duplicates = {paths[i] for rows in duplicate_rows for i in rows.tolist()}
+    near_duplicates = {paths[i] for rows in near_duplicate_rows for i in rows.tolist()}
+    return position_to_files, duplicate_positions, near_duplicate_positions, duplicates, near_duplicates
+
+def build_cleaning_operations(update_name=False, remove_description_field=False, clear_name=False, round_positions=False, num_decimals=None, name_field='name', description_field='description', cleared_field='name', position_field='position'):
+    # The field paths are compiled here, once per scan, rather than for every file.
+    operations = []
+    if round_positions:
+        operations.append(partial(round_field, num_decimals=num_decimals, field=compile_key_path(position_field)))
+    if update_name:
+        operations.append(partial(write_filename_to_field, field=compile_key_path(name_field)))
+    if remove_description_field:
+        operations.append(partial(delete_field, field=compile_key_path(description_field)))
+    if clear_name:
+        operations.append(partial(clear_field, field=compile_key_path(cleared_field)))
+    return tuple(operations)
+
+def update_name_field(file_path):
+    transform_file(file_path, [write_filename_to_field])
+
+def remove_description(file_path):
+    transform_file(file_path, [delete_field])
+
+def clear_name_value(file_path):
+    transform_file(file_path, [clear_field])
+
+def round_positions_in_file(file_path, num_decimals):
+    transform_file(file_path, [partial(round_field, num_decimals=num_decimals)])
+
+class PositionGridIndex:
+    # Uniform grid over group positions. Cells are slightly wider than the tolerance so that any two
+    # positions within tolerance on every axis always land in the same or neighbouring cells. Only
+    # axes (by default the first GRID_AXES) are gridded; candidates are checked on every axis.
+    def __init__(self, tolerance, axes=None):
+        self.tolerance = tolerance or 0
+        self.cell_size = self.tolerance * (1 + 1e-9) if self.tolerance > 0 else None
+        self.axes = list(axes) if axes is not None else None
+        self.cells = defaultdict(list)
+        self.order = {}
+        self.offsets = {}
+
+    def __len__(self):
+        return len(self.order)
+
+    def cell_of(self, position):
+        if self.cell_size is None:
+            return tuple(position)
+        if self.axes is not None:
+            position = [position[axis] for axis in self.axes if axis < len(position)]
+        else:
+            position = position[:GRID_AXES]
+        return tuple(math.floor(x / self.cell_size) for x in position)
+
+    def add(self, position):
+        if position in self.order:
+            return
+        self.order[position] = len(self.order)
+        self.cells[self.cell_of(position)].append(position)
+
+    def remove(self, position):
+        if self.order.pop(position, None) is None:
+            return
+        cell = self.cell_of(position)
+        self.cells[cell].remove(position)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def cell_offsets(self, dims):
+        offsets = self.offsets.get(dims)
+        if offsets is None:
+            steps = (-1, 0, 1) if self.cell_size is not None else (0,)
+            offsets = self.offsets[dims] = list(itertools.product(steps, repeat=dims))
+        return offsets
+
+    def find(self, position):
+        # Returns the earliest added position within tolerance on every axis, matching the order of
+        # the old linear scan over position_to_files.
+        cell = self.cell_of(position)
+        match = None
+        for offset in self.cell_offsets(len(cell)):
+            candidates = self.cells.get(tuple(c + o for c, o in zip(cell, offset)))
+            if not candidates:
+                continue
+            for existing_position in candidates:
+                if match is not None and self.order[existing_position] > self.order[match]:
+                    break
+                if len(existing_position) == len(position) and all(abs(a - b) <= self.tolerance for a, b in zip(position, existing_position)):
+                    match = existing_position
+                    break
+        return match
+
+    def find_all(self, position):
+        # Every added position within tolerance on every axis, in the order they were added.
+        cell = self.cell_of(position)
+        found = []
+        for offset in self.cell_offsets(len(cell)):
+            for existing_position in self.cells.get(tuple(c + o for c, o in zip(cell, offset)), ()):
+                if len(existing_position) == len(position) and all(abs(a - b) <= self.tolerance for a, b in zip(position, existing_position)):
+                    found.append(existing_position)
+        return sorted(found, key=self.order.__getitem__)
+
+class ScanCancelled(Exception):
+    pass
+
+class ScanControl:
+    # Lets another thread (e.g. the GUI) pause, resume or cancel a running scan. The scan checks it
+    # between files, so a paused scan only finishes the chunks already handed to workers.
+    def __init__(self):
+        self.running = threading.Event()
+        self.running.set()
+        self.cancelled = threading.Event()
+
+    @property
+    def paused(self):
+        return not self.running.is_set()
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.running.set()
+
+    def checkpoint(self):
+        self.running.wait()
+        if self.cancelled.is_set():
+            raise ScanCancelled()
+
+def scan_file(file_path, num_decimals=None, ignore_empty=False, operations=(), position_backend='scan', match_keys=DEFAULT_MATCH_KEYS, collect_stats=False, write_back=None):
+    # Runs every per-file step of a scan on a single load of the file and returns
+    # (file_path, position, mtime_ns, size) as the file stands afterwards. It only touches the file
+    # itself so it can run in a worker process; rounding for grouping and the grouping itself
+    # happen in the caller. With collect_stats, the per-file stage timings are appended to the
+    # result for ScanStats.add_file.
+    timer = FileTimer() if collect_stats else NULL_TIMER
+    try:
+        stat_result = os.stat(file_path)
+        timer.lap('stat')
+        if not operations:
+            # Nothing to rewrite, so only the position has to be read.
+            position = extract_positions(file_path, position_backend, match_keys, timer)
+            return timer.finish((file_path, position, stat_result.st_mtime_ns, stat_result.st_size))
         try:
-            position = extract_positions(file_path)
-            if position or not ignore_empty:
-                if round_positions:
-                    round_positions_in_file(file_path, num_decimals)
-                rounded_position = round_position(position, num_decimals, file_path) if num_decimals is not None else position
-                if rounded_position is not None:
-                    if rounded_position in position_to_files:
-                        position_to_files[rounded_position].append(file_path)
-                        duplicate_positions.add(rounded_position)
-                        duplicates.add(file_path)
-                    elif find_near_duplicates:
-                        for existing_position in position_to_files:
-                            if np.all(np.abs(np.array(rounded_position) - np.array(existing_position)) <= tolerance):
-                                position_to_files[existing_position].append(file_path)
-                                near_duplicate_positions.add(existing_position)
-                                near_duplicates.add(file_path)
-                                break
-                        else:
-                            position_to_files[rounded_position] = [file_path]
-                    else:
-                        position_to_files[rounded_position] = [file_path]
-                    if update_name:
-                        update_name_field(file_path)
-                    if remove_description:
-                        remove_description(file_path)
-                    if clear_name:
-                        clear_name_value(file_path)
-        except Exception as e:
+            text, data = read_json_file(file_path, timer)
+        except (json.JSONDecodeError, FileNotFoundError) as e:
             logging.error(f"Error processing file: {file_path} - {str(e)}")
+            timer.error = type(e).__name__
+            return timer.finish((file_path, None, stat_result.st_mtime_ns, stat_result.st_size))
+        position = position_from_data(data, match_keys)
+        if position or not ignore_empty:
+            if match_keys != DEFAULT_MATCH_KEYS:
+                rounded_position = position if position is not None and split_match_key(position) is not None else None
+            else:
+                rounded_position = round_position(position, num_decimals, file_path) if num_decimals is not None else position
+            timer.lap('rounding')
+            if rounded_position is not None:
+                changed = apply_operations(data, file_path, operations)
+                timer.lap('operations')
+                if changed and write_json_file(file_path, data, text, write_back):
+                    stat_result = os.stat(file_path)
+                    position = position_from_data(data, match_keys)
+                    timer.lap('write')
+                    timer.rewritten = True
+        return timer.finish((file_path, position, stat_result.st_mtime_ns, stat_result.st_size))
+    except Exception as e:
+        logging.error(f"Error processing file: {file_path} - {str(e)}")
+        timer.error = type(e).__name__
+        return timer.finish((file_path, None, None, None))
 
-        if progress_callback:
-            progress_callback(index, total_files, file_path)
+def scan_chunk(scan, file_paths):
+    results = [scan(file_path) for file_path in file_paths]
+    # A worker syncs the directories of the files it rewrote once per chunk.
+    write_back = getattr(scan, 'keywords', {}).get('write_back')
+    if write_back is not None:
+        write_back.sync()
+    return results
 
-    for rounded_position, file_paths in position_to_files.items():
-        selected_file = None
+def iter_scan_results(file_paths, scan, workers=1, chunk_size=64):
+    # Yields scan results in the same order as file_paths. With more than one worker, chunks of files
+    # are fanned out to a process pool while only a bounded number of chunks are in flight.
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
         for file_path in file_paths:
-            if file_path not in filenames_within_group[rounded_position]:
-                filenames_within_group[rounded_position].add(file_path)
-                selected_file = file_path
-                break
+            yield scan(file_path)
+        return
+
+    file_paths = iter(file_paths)
+    chunks = iter(lambda: list(itertools.islice(file_paths, chunk_size)), [])
+    # Workers must not be forked: the enumerator, scan and Tk threads may be running and their locks
+    # would be copied into the children mid-operation. forkserver forks from a clean single-threaded
+    # server; Windows only has spawn.
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method))
+    try:
+        pending = deque(executor.submit(scan_chunk, scan, chunk) for chunk in itertools.islice(chunks, workers * 2))
+        while pending:
+            results = pending.popleft().result()
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(executor.submit(scan_chunk, scan, chunk))
+            yield from results
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def iter_cached_scan_results(file_entries, scan, cache, directory_path, rebuild_cache=False, use_cached=True, workers=1, chunk_size=64):
+    # Serves up-to-date files from the scan cache and only scans new or changed ones, keeping the
+    # results in file order. file_entries are (file_path, stat_result) pairs as produced by
+    # FileEnumerator(with_stat=True); a None stat_result is looked up here. Every result is written
+    # back to the cache and entries for files that were not seen are dropped once the scan completes.
+    if rebuild_cache:
+        cache.clear(directory_path)
+        entries = {}
+    else:
+        entries = cache.load(directory_path)
+    seen_paths = set()
+
+    def plan():
+        for file_path, stat_result in file_entries:
+            cache_path = os.path.abspath(file_path)
+            seen_paths.add(cache_path)
+            try:
+                stat_result = stat_result or os.stat(file_path)
+            except OSError:
+                yield file_path, None
+                continue
+            hit, position = cache.lookup(entries, cache_path, stat_result) if use_cached else (False, None)
+            yield file_path, (file_path, position, stat_result.st_mtime_ns, stat_result.st_size) if hit else None
+
+    plan_for_order, plan_for_scan = itertools.tee(plan())
+    scanned = iter_scan_results((file_path for file_path, hit in plan_for_scan if hit is None), scan, workers=workers, chunk_size=chunk_size)
+    for file_path, hit in plan_for_order:
+        if hit is not None:
+            yield hit
+            continue
+        result = next(scanned)
+        if result[2] is not None:
+            cache.store(os.path.abspath(result[0]), result[2], result[3], result[1])
+        yield result
+    cache.prune(directory_path, seen_paths)
+
+def canonical_json(data, ignore_fields=()):
+    # Serialization that does not depend on key order or formatting; top-level fields in
+    # ignore_fields are left out.
+    if ignore_fields and isinstance(data, dict):
+        data = {key: value for key, value in data.items() if key not in ignore_fields}
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def hash_file(file_path, normalized=False, ignore_fields=()):
+    # Returns (file_path, hex digest), or (file_path, None) if the file cannot be read (or, when
+    # normalized, parsed). Raw hashes cover the bytes on disk; normalized hashes cover
+    # canonical_json of the parsed document.
+    try:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as f:
+            if normalized:
+                digest.update(canonical_json(json_backend.loads(f.read()), ignore_fields))
+            else:
+                for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                    digest.update(block)
+        return file_path, digest.hexdigest()
+    except (OSError, ValueError) as e:
+        logging.error(f"Error processing file: {file_path} - {str(e)}")
+        return file_path, None
 
-    return position_to_files, duplicate_positions, near_duplicate_positions, invalid_positions, filenames_within_group
+def group_contents(sized_files, normalized=False, ignore_fields=(), workers=1, chunk_size=64, control=None, stats=None, progress_callback=None):
+    # Groups (file_path, size) pairs by content. Byte-identical files must have the same size, so in
+    # raw mode only files sharing their size with another file are hashed. Normalized contents can
+    # differ in size on disk, so there every file is parsed and hashed.
+    # Returns content_to_files, duplicate_contents, the set of duplicate file paths (every file but
+    # the first of each group) and the files that could not be hashed. progress_callback is called
+    # after each hashed file with its index among the files to hash.
+    if normalized:
+        candidates = [file_path for file_path, _ in sized_files]
+    else:
+        size_counts = defaultdict(int)
+        for _, size in sized_files:
+            size_counts[size] += 1
+        candidates = [file_path for file_path, size in sized_files if size_counts[size] > 1]
+
+    content_to_files = defaultdict(list)
+    unreadable_files = []
+    hash_one = partial(hash_file, normalized=normalized, ignore_fields=tuple(ignore_fields))
+    hashes = iter_scan_results(candidates, hash_one, workers=workers, chunk_size=chunk_size)
+    try:
+        for index, (file_path, digest) in enumerate(hashes, start=1):
+            if control is not None:
+                control.checkpoint()
+            if digest is None:
+                unreadable_files.append(file_path)
+            else:
+                content_to_files[digest].append(file_path)
+            if progress_callback:
+                progress_callback(index, len(candidates), file_path)
+    finally:
+        hashes.close()
+
+    if stats is not None:
+        stats.count('files_hashed', len(candidates))
+    duplicate_contents = {digest for digest, file_paths in content_to_files.items() if len(file_paths) > 1}
+    duplicate_files = {file_path for digest in duplicate_contents for file_path in content_to_files[digest][1:]}
+    return content_to_files, duplicate_contents, duplicate_files, unreadable_files
+
+def find_duplicate_and_near_duplicate_positions(directory_path, duplicates, near_duplicates, file_pattern='*.json', ignore_empty=False, num_decimals=None, update_name=False, remove_description=False, clear_name=False, round_positions=False, find_near_duplicates=False, tolerance=1, progress_callback=None, workers=1, chunk_size=64, use_cache=False, rebuild_cache=False, cache_path=None, position_backend='scan', control=None, exclude_patterns=(), exclude_dirs=(), max_depth=None, match_by='position', ignore_fields=(), match_keys='position', name_field='name', description_field='description', cleared_field='name', stats=None, low_memory=False, memory_budget=LOW_MEMORY_BUDGET, output_format='indented', fsync=False, watch_index=None):
+    # match_by is 'position', 'content' (byte-identical files) or 'normalized' (identical after
+    # canonical_json, leaving out ignore_fields). In the content modes the groups are keyed by the
+    # content hash and there are no near duplicates.
+    #
+    # low_memory keeps the scanned paths compact and spills positions to temporary files once they
+    # take more than memory_budget bytes (see PositionStore); position_to_files then only holds the
+    # positions with duplicates. Invalid positions are collected per call, in a new set every time.
+    #
+    # Cleaned files are written back as output_format ('indented' or 'compact'), each one replaced
+    # atomically; fsync makes the rewrites durable, syncing every directory once (see WriteBack).
+    #
+    # watch_index, if given, is a watch.PositionIndex that is filled with every scanned position, so
+    # watch mode can carry on from this scan (position matching only).
+    filenames_within_group = defaultdict(set)
+    invalid_positions = set()
+    # stats, if given, is a ScanStats that collects stage timings and counters for this scan.
+    if stats is not None:
+        stats.start()
+    try:
+        content_mode = match_by != 'position'
+        # match_keys are key paths (e.g. 'transform.translation', or ['transform.translation', 'map'] for
+        # a compound key); the cleaning options act on the given field paths.
+        match_keys = compile_key_paths(match_keys)
+        compound_key = match_keys != DEFAULT_MATCH_KEYS
 
-def save_preferences(preferences):
-    preferences_file = Path(script_dir, 'preferences.json')
-    with open(preferences_file, 'w') as f:
-        json.dump(preferences, f, indent=4)
+        # Files are listed on a background thread while the scan runs; the total passed to
+        # progress_callback is None until the listing is complete.
+        files = FileEnumerator(directory_path, include=file_pattern, exclude=exclude_patterns, exclude_dirs=exclude_dirs, max_depth=max_depth, with_stat=use_cache or content_mode)
 
-def load_preferences():
-    preferences_file = Path(script_dir, 'preferences.json')
-    if preferences_file.exists():
+        operations = build_cleaning_operations(update_name=update_name, remove_description_field=remove_description, clear_name=clear_name, round_positions=round_positions, num_decimals=num_decimals, name_field=name_field, description_field=description_field, cleared_field=cleared_field, position_field=match_keys[0])
+        write_back = WriteBack(output_format, fsync) if operations else None
+        scan = partial(scan_file, num_decimals=num_decimals, ignore_empty=ignore_empty, operations=operations, position_backend=position_backend, match_keys=match_keys, collect_stats=stats is not None, write_back=write_back)
+
+        cache = None
+        if content_mode and not operations:
+            # Only the sizes are needed up front, and those come with the listing.
+            results = ((file_path, None, stat_result and stat_result.st_mtime_ns, stat_result and stat_result.st_size) for file_path, stat_result in files)
+        elif content_mode:
+            results = iter_scan_results((file_path for file_path, _ in files), scan, workers=workers, chunk_size=chunk_size)
+        elif use_cache:
+            if cache_path is None and match_keys != DEFAULT_MATCH_KEYS:
+                # Cached values depend on the match keys, so other keys get a cache file of their own.
+                key_digest = hashlib.blake2b('\n'.join(key_path.path for key_path in match_keys).encode('utf-8'), digest_size=4).hexdigest()
+                cache_path = Path(script_dir, f'scan_cache-{key_digest}.sqlite3')
+            cache = ScanCache(cache_path or Path(script_dir, 'scan_cache.sqlite3'))
+            # Files that need cleaning have to be opened anyway, so the cache is only read when there are
+            # no cleaning operations; it is still refreshed from what the scan finds.
+            results = iter_cached_scan_results(files, scan, cache, directory_path, rebuild_cache=rebuild_cache, use_cached=not operations, workers=workers, chunk_size=chunk_size)
+        else:
+            results = iter_scan_results(files, scan, workers=workers, chunk_size=chunk_size)
+        store = PositionStore(low_memory=low_memory, memory_budget=memory_budget, num_decimals=num_decimals)
+        sized_files = []
+        scan_start = time.perf_counter()
         try:
-            with open(preferences_file, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, ValueError) as e:
-            logging.error(f"Error loading preferences: {str(e)}. Using default settings.")
-    return None  # Preferences file either doesn't exist or couldn't be loaded
+            for index, result in enumerate(results, start=1):
+                if control is not None:
+                    control.checkpoint()
+                file_path, position, _, size = result[:4]
+                if stats is not None:
+                    stats.add_file(file_path, result)
+                if content_mode:
+                    if size is None:
+                        invalid_positions.add(file_path)
+                    else:
+                        sized_files.append((file_path, size))
+                elif position or not ignore_empty:
+                    partition = ()
+                    if compound_key and position is not None:
+                        match_key = split_match_key(position)
+                        position = None if match_key is None else match_key[1]
+                        partition = () if match_key is None else match_key[0]
+                    if position is None:
+                        if num_decimals is not None:
+                            invalid_positions.add(file_path)
+                    else:
+                        try:
+                            store.add(file_path, position, partition)
+                        except (TypeError, ValueError) as e:
+                            logging.error(f"Error processing file: {file_path} - {str(e)}")
+
+                if progress_callback:
+                    progress_callback(index, files.total, file_path)
+        finally:
+            # Stops the worker pool straight away if the scan was cancelled or failed.
+            results.close()
+            files.close()
+            if write_back is not None:
+                write_back.sync()
+            if cache is not None:
+                cache.close()
+            if stats is not None:
+                stats.add_stage_time('scanning', time.perf_counter() - scan_start)
+                stats.add_stage_time('listing', files.elapsed)
+
+        grouping_start = time.perf_counter()
+        if content_mode:
+            position_to_files, duplicate_positions, duplicate_files, unreadable_files = group_contents(sized_files, normalized=match_by == 'normalized', ignore_fields=ignore_fields, workers=workers, chunk_size=chunk_size, control=control, stats=stats, progress_callback=progress_callback)
+            invalid_positions.update(unreadable_files)
+            near_duplicate_positions, near_duplicate_files = set(), set()
+        else:
+            try:
+                if watch_index is not None:
+                    watch_index.add_store(store)
+                position_to_files, duplicate_positions, near_duplicate_positions, duplicate_files, near_duplicate_files = group_positions(store, num_decimals=num_decimals, find_near_duplicates=find_near_duplicates, tolerance=tolerance, stats=stats)
+            finally:
+                store.close()
+            if stats is not None and store.spill_count:
+                stats.count('spills', store.spill_count)
+        if stats is not None:
+            stats.add_stage_time('hashing' if content_mode else 'grouping', time.perf_counter() - grouping_start)
+            stats.count('groups', len(duplicate_positions | near_duplicate_positions))
+            stats.count('invalid', len(invalid_positions))
+        duplicates.update(duplicate_files)
+        near_duplicates.update(near_duplicate_files)
+
+        for rounded_position, file_paths in position_to_files.items():
+            selected_file = None
+            for file_path in file_paths:
+                if file_path not in filenames_within_group[rounded_position]:
+                    filenames_within_group[rounded_position].add(file_path)
+                    selected_file = file_path
+                    break
+
+        return position_to_files, duplicate_positions, near_duplicate_positions, invalid_positions, filenames_within_group
+    finally:
+        if stats is not None:
+            stats.stop()
 
 script_dir = Path(__file__).parent.resolve()
\ No newline at end of file
@@ -0,0 +1,160 @@
+import json
+import re
+from functools import lru_cache
+
+# A key path names a value inside a document: dot-separated object keys with optional [n] list
+# indices, e.g. 'position', 'transform.translation' or 'points[0].xyz'.
+_STEP = re.compile(r'([^.\[\]]+)|\[(-?\d+)\]')
+
+
+class KeyPathError(ValueError):
+    pass
+
+
+def parse_key_path(path):
+    steps = []
+    index = 0
+    while index < len(path):
+        if steps and path[index] == '.':
+            index += 1
+        match = _STEP.match(path, index)
+        if match is None:
+            raise KeyPathError(f"Invalid key path: {path!r}")
+        steps.append(match.group(1) if match.group(1) is not None else int(match.group(2)))
+        index = match.end()
+    if not steps:
+        raise KeyPathError("Empty key path")
+    return tuple(steps)
+
+
+def walk(data, steps, default=None):
+    for step in steps:
+        if isinstance(step, str):
+            if not isinstance(data, dict) or step not in data:
+                return default
+        elif not isinstance(data, list) or not -len(data) <= step < len(data):
+            return default
+        data = data[step]
+    return data
+
+
+class KeyPath:
+    # A parsed key path with get/set/delete specialised for its shape when it is built, so the
+    # per-file calls do no parsing at all. Top-level keys (the common case) go straight to
+    # dict.get. Instances pickle as their path so they can be sent to worker processes.
+    def __init__(self, path):
+        self.path = path
+        self.steps = parse_key_path(path)
+        self.head = self.steps[0]
+        self.parent_steps = self.steps[:-1]
+        self.last = self.steps[-1]
+        if len(self.steps) == 1 and isinstance(self.last, str):
+            self.get = self.get_top_level
+
+    def __repr__(self):
+        return f"KeyPath({self.path!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, KeyPath) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __reduce__(self):
+        return compile_key_path, (self.path,)
+
+    def get_top_level(self, data, default=None):
+        if isinstance(data, dict):
+            return data.get(self.last, default)
+        return default
+
+    def get(self, data, default=None):
+        return walk(data, self.steps, default)
+
+    def get_below_head(self, value, default=None):
+        # For readers that already fetched the value of the first step (e.g. position_reader, which
+        # only decodes one top-level key).
+        return walk(value, self.steps[1:], default)
+
+    def container(self, data, create=False):
+        # The object or list holding the last step, or None if the path does not lead there.
+        for step, next_step in zip(self.parent_steps, self.steps[1:]):
+            try:
+                child = data[step]
+            except (KeyError, IndexError, TypeError):
+                if not create or not isinstance(data, dict) or not isinstance(step, str) or isinstance(next_step, int):
+                    return None
+                child = data[step] = {}
+            data = child
+        if isinstance(self.last, str) and not isinstance(data, dict):
+            return None
+        if isinstance(self.last, int) and not isinstance(data, list):
+            return None
+        return data
+
+    def set(self, data, value):
+        # Missing objects along the path are created; returns whether anything changed.
+        container = self.container(data, create=True)
+        if container is None:
+            return False
+        try:
+            if container[self.last] == value:
+                return False
+        except (KeyError, IndexError):
+            if isinstance(self.last, int):
+                return False
+        container[self.last] = value
+        return True
+
+    def delete(self, data):
+        container = self.container(data)
+        if container is None:
+            return False
+        try:
+            del container[self.last]
+        except (KeyError, IndexError):
+            return False
+        return True
+
+
+@lru_cache(maxsize=None)
+def _compile_key_path(path):
+    return KeyPath(path)
+
+
+def compile_key_path(path):
+    # Compiles each distinct path once per process; compiled paths are returned as they are.
+    if isinstance(path, KeyPath):
+        return path
+    return _compile_key_path(path)
+
+
+def compile_key_paths(paths):
+    if isinstance(paths, (str, KeyPath)):
+        paths = [paths]
+    return tuple(compile_key_path(path if isinstance(path, KeyPath) else path.strip()) for path in paths if isinstance(path, KeyPath) or path.strip())
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def split_match_key(values):
+    # Splits the values of a compound match key into (partition, coordinates). Numbers and lists of
+    # numbers become coordinates, which are rounded and compared within the tolerance; any other
+    # value partitions the files, so only files with equal non-numeric values are ever grouped.
+    # Returns None if any of the values is missing.
+    partition = []
+    coordinates = []
+    for value in values:
+        if value is None:
+            return None
+        if is_number(value):
+            coordinates.append(value)
+        elif isinstance(value, (list, tuple)) and value and all(is_number(x) for x in value):
+            coordinates.extend(value)
+        elif isinstance(value, (str, int)):
+            partition.append(value)
+        else:
+            partition.append(json.dumps(value, sort_keys=True))
+    return tuple(partition), tuple(coordinates)
@@ -0,0 +1,226 @@
+import json
+import mmap
+import os
+import re
+from functools import lru_cache
+
+import json_backend
+from scan_stats import NULL_TIMER
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Small files are cheaper to hand straight to json; larger ones are scanned through mmap so that
+# only the requested value is decoded.
+SCAN_THRESHOLD = 32 * 1024
+# Skipping containers bracket by bracket in Python loses to json's C parser on large, deeply
+# structured values, so past this many brackets the scanner gives up and parses the whole file.
+MAX_SKIPPED_BRACKETS = 128
+# Likewise for escapes: the string patterns step over them one at a time, while json decodes them
+# in C, so text with more escapes than this in the part to be walked is parsed in full instead.
+MAX_SKIPPED_ESCAPES = 4096
+
+_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+# Strings are matched unrolled (runs of plain bytes between escapes) rather than byte by byte.
+_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+# Everything up to the next bracket that is not inside a string.
+_CONTAINER_CONTENT = re.compile(rb'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.DOTALL)
+_SCALAR_END = re.compile(rb'[,\]}\s]')
+
+
+class FallbackToFullParse(Exception):
+    pass
+
+
+def _skip_whitespace(buffer, index):
+    return _WHITESPACE.match(buffer, index).end()
+
+
+def _skip_string(buffer, index):
+    match = _STRING.match(buffer, index)
+    if match is None:
+        raise FallbackToFullParse()
+    return match.end()
+
+
+def _escape_horizon(buffer, start, limit):
+    # How far from start the buffer can be walked without stepping over more than limit escapes:
+    # the position of the escape after the limit-th, or the end of the buffer.
+    for _ in range(limit + 1):
+        start = buffer.find(b'\\', start)
+        if start < 0:
+            return len(buffer)
+        start += 2
+    return start - 2
+
+
+def _skip_value(buffer, index, budget):
+    first = buffer[index:index + 1]
+    if first == b'"':
+        return _skip_string(buffer, index)
+    if first in (b'{', b'['):
+        depth = 0
+        while True:
+            index = _CONTAINER_CONTENT.match(buffer, index).end()
+            token = buffer[index:index + 1]
+            if not token or token == b'"':
+                raise FallbackToFullParse()
+            index += 1
+            budget[0] -= 1
+            if budget[0] < 0:
+                raise FallbackToFullParse()
+            depth += 1 if token in (b'{', b'[') else -1
+            if depth == 0:
+                return index
+    if not first:
+        raise FallbackToFullParse()
+    match = _SCALAR_END.search(buffer, index)
+    return match.start() if match else len(buffer)
+
+
+@lru_cache(maxsize=None)
+def key_pattern(key):
+    # Matches key as a JSON string however it is spelled: each character as itself or as a \u
+    # escape (a surrogate pair outside the BMP), and the characters json escapes with a backslash
+    # as that escape.
+    short_escapes = {'"': '\\"', '\\': '\\\\', '/': '\\/', '\b': '\\b', '\f': '\\f', '\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+    def unicode_escape(code_unit):
+        return rb'\\u' + b''.join(f'[{digit}{digit.upper()}]'.encode() if digit.isalpha() else digit.encode() for digit in f'{code_unit:04x}')
+
+    parts = []
+    for character in key:
+        spellings = [re.escape(character.encode())]
+        if character in short_escapes:
+            spellings.append(re.escape(short_escapes[character].encode()))
+        code_units = character.encode('utf-16-be')
+        spellings.append(b''.join(unicode_escape(int.from_bytes(code_units[i:i + 2], 'big')) for i in range(0, len(code_units), 2)))
+        parts.append(b'(?:' + b'|'.join(spellings) + b')')
+    return re.compile(b'"' + b''.join(parts) + b'"')
+
+
+def locate_top_level_value(buffer, key='position'):
+    # Walks the members of the top-level object without decoding them. Nested values are skipped by
+    # matching brackets outside of strings. Returns the (start, end) span of the value of key, or
+    # None if the key is absent, and how far into the buffer was looked at. Raises
+    # FallbackToFullParse when the buffer is not something this scanner understands (not an
+    # object, truncated, ...) or would take longer to walk than to parse.
+    #
+    # Like json.loads, the last of repeated keys wins. A search for the key (in any spelling) finds
+    # the last place it can occur, so the walk stops there rather than at the end of the buffer;
+    # usually that is right after the first occurrence. If getting there means stepping over more
+    # than MAX_SKIPPED_ESCAPES escapes, the search stops early and the buffer is parsed in full.
+    index = _skip_whitespace(buffer, 0)
+    if buffer[index:index + 1] != b'{':
+        raise FallbackToFullParse()
+    horizon = _escape_horizon(buffer, index, MAX_SKIPPED_ESCAPES)
+    pattern = key_pattern(key)
+    match = pattern.search(buffer, index, horizon)
+    if match is None:
+        if horizon < len(buffer):
+            raise FallbackToFullParse()
+        return None, len(buffer)
+    last_candidate = match.start()
+    for match in pattern.finditer(buffer, match.end()):
+        last_candidate = match.start()
+        if last_candidate > horizon:
+            break
+    if last_candidate > horizon:
+        raise FallbackToFullParse()
+    encoded_key = json.dumps(key).encode()
+    budget = [MAX_SKIPPED_BRACKETS]
+    index = _skip_whitespace(buffer, index + 1)
+    if buffer[index:index + 1] == b'}':
+        return None, len(buffer)
+    span = None
+    while True:
+        key_end = _skip_string(buffer, index)
+        raw_key = buffer[index:key_end]
+        index = _skip_whitespace(buffer, key_end)
+        if buffer[index:index + 1] != b':':
+            raise FallbackToFullParse()
+        index = _skip_whitespace(buffer, index + 1)
+        value_end = _skip_value(buffer, index, budget)
+        if raw_key == encoded_key or (b'\\' in raw_key and json.loads(raw_key) == key):
+            span = (index, value_end)
+        if value_end > last_candidate:
+            # No later member can be key.
+            return span, len(buffer)
+        index = _skip_whitespace(buffer, value_end)
+        separator = buffer[index:index + 1]
+        if separator == b'}':
+            return span, len(buffer)
+        if separator != b',':
+            raise FallbackToFullParse()
+        index = _skip_whitespace(buffer, index + 1)
+
+
+def scan_top_level_value(buffer, key='position'):
+    # Decodes only the value of key (None if absent); see locate_top_level_value.
+    span, _ = locate_top_level_value(buffer, key)
+    return None if span is None else json_backend.loads(buffer[span[0]:span[1]])
+
+
+def read_position_json(file_path, key='position', timer=NULL_TIMER):
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    timer.lap('read')
+    timer.bytes_read += len(raw)
+    value = json_backend.loads(raw).get(key)
+    timer.lap('parse')
+    return value
+
+
+def read_position_scan(file_path, key='position', timer=NULL_TIMER):
+    try:
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < SCAN_THRESHOLD:
+                raw = f.read()
+                timer.lap('read')
+                timer.bytes_read += len(raw)
+                value = json_backend.loads(raw).get(key)
+                timer.lap('parse')
+                return value
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                # The walk is mostly regex work, but it also pages the file in as it goes, so it
+                # gets a stage of its own rather than passing for either reading or parsing.
+                span, walked = locate_top_level_value(buffer, key)
+                timer.lap('scan')
+                timer.bytes_read += walked
+                value = None if span is None else json_backend.loads(buffer[span[0]:span[1]])
+                timer.lap('parse')
+                return value
+    except (FallbackToFullParse, ValueError, UnicodeDecodeError):
+        return read_position_json(file_path, key, timer)
+
+
+def read_position_ijson(file_path, key='position', timer=NULL_TIMER):
+    # ijson reads as it parses, so it all counts as parsing. The last of repeated keys wins, as
+    # with json.loads.
+    with open(file_path, 'rb') as f:
+        value = None
+        try:
+            for value in ijson.items(f, key, use_float=True):
+                pass
+            return value
+        finally:
+            timer.lap('parse')
+            timer.bytes_read += f.tell()
+
+
+# Backends return the raw value stored under key in the top-level object (None if absent) and let
+# json.JSONDecodeError / OSError propagate, like a plain json.load would. With a timer (see
+# scan_stats.FileTimer) they lap 'read' and 'parse' ('scan' for the mmap walk) and count the bytes
+# they actually read.
+POSITION_BACKENDS = {
+    'json': read_position_json,
+    'scan': read_position_scan,
+}
+if ijson is not None:
+    POSITION_BACKENDS['ijson'] = read_position_ijson
+
+
+def read_position(file_path, backend='scan', key='position', timer=NULL_TIMER):
+    return POSITION_BACKENDS[backend](file_path, key, timer)
@@ -0,0 +1,24 @@
+import json
+import logging
+from pathlib import Path
+
+import json_backend
+from write_back import replace_file, serialize
+
+# The GUI reads its preferences as soon as the window is up, so this module stays clear of NumPy
+# and the scanning modules.
+
+script_dir = Path(__file__).parent.resolve()
+
+def save_preferences(preferences):
+    preferences_file = Path(script_dir, 'preferences.json')
+    replace_file(preferences_file, serialize(preferences))
+
+def load_preferences():
+    preferences_file = Path(script_dir, 'preferences.json')
+    if preferences_file.exists():
+        try:
+            return json_backend.loads(preferences_file.read_bytes())
+        except (json.JSONDecodeError, ValueError) as e:
+            logging.error(f"Error loading preferences: {str(e)}. Using default settings.")
+    return None  # Preferences file either doesn't exist or couldn't be loaded
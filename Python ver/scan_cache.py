@@ -0,0 +1,67 @@
+import json
+import os
+import sqlite3
+
+
+class ScanCache:
+    # On-disk record of the position extracted from each file, keyed by absolute path and
+    # invalidated by the file's mtime and size.
+    def __init__(self, cache_path):
+        self.connection = sqlite3.connect(str(cache_path))
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, position TEXT)"
+        )
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def directory_range(directory_path):
+        prefix = os.path.join(os.path.abspath(directory_path), '')
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def load(self, directory_path):
+        rows = self.connection.execute(
+            "SELECT path, mtime_ns, size, position FROM files WHERE path >= ? AND path < ?",
+            self.directory_range(directory_path),
+        )
+        return {path: (mtime_ns, size, position) for path, mtime_ns, size, position in rows}
+
+    @staticmethod
+    def lookup(entries, file_path, stat_result):
+        # Returns (True, position) for an up-to-date entry and (False, None) otherwise.
+        entry = entries.get(file_path)
+        if entry is None or entry[0] != stat_result.st_mtime_ns or entry[1] != stat_result.st_size:
+            return False, None
+        position = entry[2]
+        return True, tuple(json.loads(position)) if position is not None else None
+
+    def store(self, file_path, mtime_ns, size, position):
+        self.pending.append((file_path, mtime_ns, size, json.dumps(list(position)) if position is not None else None))
+        if len(self.pending) >= 1000:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", self.pending)
+            self.pending = []
+
+    def prune(self, directory_path, seen_paths):
+        # Drops entries under directory_path for files that were not part of this scan.
+        self.flush()
+        stale = [(path,) for path in self.load(directory_path) if path not in seen_paths]
+        self.connection.executemany("DELETE FROM files WHERE path = ?", stale)
+        return len(stale)
+
+    def clear(self, directory_path):
+        self.pending = []
+        self.connection.execute("DELETE FROM files WHERE path >= ? AND path < ?", self.directory_range(directory_path))
+
+    def close(self):
+        self.flush()
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,149 @@
+import cProfile
+import heapq
+import io
+import json
+import pstats
+import time
+from collections import Counter, defaultdict
+
+
+class FileTimer:
+    # Per-file stage timings, taken inside scan_file (possibly in a worker process) and sent back
+    # with its result as a plain tuple.
+    __slots__ = ('stages', 'last', 'bytes_read', 'rewritten', 'error')
+
+    def __init__(self):
+        self.stages = {}
+        self.last = time.perf_counter()
+        self.bytes_read = 0
+        self.rewritten = False
+        self.error = None
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def finish(self, result):
+        return result + ((self.stages, self.bytes_read, self.rewritten, self.error),)
+
+
+class NullTimer:
+    # Stands in for FileTimer when stats are off, so the scan code has no branches for it.
+    __slots__ = ()
+    bytes_read = 0
+    rewritten = False
+    error = None
+
+    def __setattr__(self, name, value):
+        pass
+
+    def lap(self, stage):
+        pass
+
+    def finish(self, result):
+        return result
+
+
+NULL_TIMER = NullTimer()
+
+
+class ScanStats:
+    # Filled in by find_duplicate_and_near_duplicate_positions(stats=...).
+    #
+    # stage_seconds are wall-clock times of the stages run by the scan itself (listing, scanning,
+    # grouping, ...). file_seconds are per-file times summed over every file, so with several
+    # workers they can add up to more than the wall-clock time. With profile, the scan in this
+    # process runs under cProfile (worker processes are not profiled).
+    def __init__(self, slowest=10, profile=False):
+        self.slowest_count = slowest
+        self.stage_seconds = defaultdict(float)
+        self.file_seconds = defaultdict(float)
+        self.counters = Counter()
+        self.errors = Counter()
+        self.slowest = []
+        self.started = None
+        self.elapsed = 0.0
+        self.profiler = cProfile.Profile() if profile else None
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.started is not None:
+            self.elapsed = time.perf_counter() - self.started
+
+    def add_stage_time(self, name, seconds):
+        self.stage_seconds[name] += seconds
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def add_file(self, file_path, result):
+        # result is what the scan produced for the file; results with file stats attached carry
+        # them as a fifth element, anything shorter was served without opening the file (from the
+        # scan cache, or from the listing in content matching mode).
+        self.counters['files'] += 1
+        if len(result) < 5:
+            self.counters['files_not_opened'] += 1
+            return
+        stages, bytes_read, rewritten, error = result[4]
+        total = 0.0
+        for stage, seconds in stages.items():
+            self.file_seconds[stage] += seconds
+            total += seconds
+        self.counters['bytes_read'] += bytes_read
+        if rewritten:
+            self.counters['files_rewritten'] += 1
+        if error is not None:
+            self.errors[error] += 1
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, (total, file_path))
+        elif self.slowest and total > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (total, file_path))
+
+    def profile_text(self, limit=30):
+        if self.profiler is None:
+            return None
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+    def dump_profile(self, file_path):
+        # Writes the raw profile, for pstats or a viewer such as snakeviz.
+        if self.profiler is not None:
+            self.profiler.dump_stats(file_path)
+
+    def to_dict(self):
+        return {
+            'elapsed_seconds': self.elapsed,
+            'stage_seconds': dict(self.stage_seconds),
+            'file_seconds': dict(self.file_seconds),
+            'counters': dict(self.counters),
+            'errors': dict(self.errors),
+            'slowest_files': [{'file': file_path, 'seconds': seconds} for seconds, file_path in sorted(self.slowest, reverse=True)],
+            'profile': self.profile_text(),
+        }
+
+    def write_report(self, file_path):
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    def summary(self):
+        lines = [f"Elapsed: {self.elapsed:.2f} s"]
+        if self.stage_seconds:
+            lines.append("Stages: " + ", ".join(f"{stage} {seconds:.2f} s" for stage, seconds in self.stage_seconds.items()))
+        if self.file_seconds:
+            lines.append("Per-file time: " + ", ".join(f"{stage} {seconds:.2f} s" for stage, seconds in self.file_seconds.items()))
+        if self.counters:
+            lines.append("Counters: " + ", ".join(f"{name} {value}" for name, value in self.counters.items()))
+        if self.errors:
+            lines.append("Errors: " + ", ".join(f"{name} {value}" for name, value in self.errors.most_common()))
+        if self.slowest:
+            seconds, file_path = max(self.slowest)
+            lines.append(f"Slowest file: {file_path} ({seconds * 1000:.1f} ms)")
+        return "\n".join(lines)
@@ -0,0 +1,391 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from collections import defaultdict
+from functools import partial
+
+from file_enumerator import FileEnumerator, matches
+from json_file_manager import DEFAULT_MATCH_KEYS, PositionGridIndex, ScanCancelled, round_array, scan_file
+from key_paths import compile_key_paths, split_match_key
+
+# Changed files are read once they have been quiet for this many seconds, so a file written in
+# several steps is only read once. The polling fallback lists the tree this often.
+DEBOUNCE_SECONDS = 0.5
+POLL_INTERVAL = 2.0
+
+# inotify event bits (see inotify(7)).
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+# Returned by a watcher instead of paths when it lost track of the tree and everything has to be
+# checked again (an inotify queue overflow).
+RESCAN = object()
+
+
+class PositionIndex:
+    # Incremental counterpart of group_positions for watch mode: which files are at which (rounded)
+    # position, updated one file at a time. Keys are the keys of position_to_files (the partition
+    # values of a compound key, then the rounded coordinates) and each key's files are kept in the
+    # order they arrived. Near duplicates are looked up per changed file in a PositionGridIndex per
+    # partition, so an update costs O(changed files) rather than a regrouping of every file.
+    #
+    # tolerance None turns near-duplicate matching off.
+    def __init__(self, num_decimals=None, tolerance=None, match_keys='position', ignore_empty=False):
+        self.num_decimals = num_decimals
+        self.tolerance = tolerance if tolerance and tolerance > 0 else None
+        self.match_keys = compile_key_paths(match_keys)
+        self.compound_key = self.match_keys != DEFAULT_MATCH_KEYS
+        self.ignore_empty = ignore_empty
+        self.key_of_file = {}
+        self.files_at = defaultdict(dict)
+        self.grids = {}
+
+    def __len__(self):
+        return len(self.key_of_file)
+
+    def match_key(self, position):
+        # (partition, coordinates) for a position as scan_file returns it, or None if the file cannot
+        # be matched. Rounding uses round(), which round_array matches.
+        if position is None or (self.ignore_empty and not position):
+            return None
+        partition = ()
+        if self.compound_key:
+            match_key = split_match_key(position)
+            if match_key is None:
+                return None
+            partition, position = match_key
+        try:
+            coordinates = tuple(float(x) for x in position)
+        except (TypeError, ValueError):
+            return None
+        if self.num_decimals is not None:
+            coordinates = tuple(round(x, self.num_decimals) for x in coordinates)
+        return partition, coordinates
+
+    def add(self, file_path, partition, coordinates):
+        self.key_of_file[file_path] = (partition, coordinates)
+        files = self.files_at[partition + coordinates]
+        files[file_path] = None
+        if len(files) == 1 and self.tolerance is not None and coordinates:
+            if partition not in self.grids:
+                self.grids[partition] = PositionGridIndex(self.tolerance)
+            self.grids[partition].add(coordinates)
+
+    def remove(self, file_path):
+        partition, coordinates = self.key_of_file.pop(file_path)
+        key = partition + coordinates
+        files = self.files_at[key]
+        del files[file_path]
+        if not files:
+            del self.files_at[key]
+            if partition in self.grids:
+                self.grids[partition].remove(coordinates)
+
+    def add_store(self, store):
+        # Seeds the index from the PositionStore of a full scan (see
+        # find_duplicate_and_near_duplicate_positions(watch_index=...)).
+        for partition, chunks in store.grouping_blocks():
+            for load in chunks:
+                coordinates, file_indices, is_rounded = load()
+                if self.num_decimals is not None and not is_rounded:
+                    coordinates = round_array(coordinates, self.num_decimals)
+                for file_index, row in zip(file_indices.tolist(), coordinates.tolist()):
+                    self.add(store.paths[file_index], partition, tuple(row))
+
+    def files_under(self, directory):
+        prefix = os.path.join(directory, '')
+        return [file_path for file_path in self.key_of_file if file_path.startswith(prefix)]
+
+    def near_files(self, partition, coordinates):
+        if self.tolerance is None or not coordinates or partition not in self.grids:
+            return []
+        return [file_path for position in self.grids[partition].find_all(coordinates) if position != coordinates for file_path in self.files_at[partition + position]]
+
+    def update(self, file_path, position):
+        # Moves file_path to its new position (None: the file is gone or has no usable position) and
+        # returns the events that caused, as dicts:
+        #   new       the file formed a new exact group with another file
+        #   joined    the file joined an existing exact group
+        #   near      the file is within tolerance of files at other positions
+        #   resolved  the file left a group that now only has one file
+        old = self.key_of_file.get(file_path)
+        new = self.match_key(position)
+        if old == new:
+            return []
+        events = []
+        if old is not None:
+            self.remove(file_path)
+            remaining = self.files_at.get(old[0] + old[1])
+            if remaining is not None and len(remaining) == 1:
+                events.append(make_event('resolved', old[0] + old[1], file_path, remaining))
+        if new is not None:
+            self.add(file_path, *new)
+            key = new[0] + new[1]
+            files = self.files_at[key]
+            if len(files) > 1:
+                events.append(make_event('new' if len(files) == 2 else 'joined', key, file_path, files))
+            near_files = self.near_files(*new)
+            if near_files:
+                events.append(make_event('near', key, file_path, list(files) + near_files))
+        return events
+
+
+def make_event(kind, key, file_path, files):
+    return {'event': kind, 'position': list(key), 'file': file_path, 'files': list(files)}
+
+
+class Debouncer:
+    # Holds changed paths until no new event has arrived for them for delay seconds.
+    def __init__(self, delay=DEBOUNCE_SECONDS):
+        self.delay = delay
+        self.last_event = {}
+
+    def __len__(self):
+        return len(self.last_event)
+
+    def add(self, paths, now):
+        for path in paths:
+            self.last_event[path] = now
+
+    def pop_due(self, now):
+        due = [path for path, last_event in self.last_event.items() if now - last_event >= self.delay]
+        for path in due:
+            del self.last_event[path]
+        return due
+
+    def timeout(self, now, default):
+        # How long to wait for events before the next path is due.
+        if not self.last_event:
+            return default
+        return max(0.0, min(self.last_event.values()) + self.delay - now)
+
+
+class PollingWatcher:
+    # Fallback for systems without inotify: lists the tree every interval seconds and reports the
+    # files that appeared, disappeared or changed mtime or size since the last listing.
+    def __init__(self, directory_path, interval=POLL_INTERVAL, **enumerator_options):
+        self.directory_path = directory_path
+        self.interval = interval
+        self.enumerator_options = enumerator_options
+        self.snapshot = self.take_snapshot()
+        self.next_poll = time.monotonic() + interval
+
+    def take_snapshot(self):
+        files = FileEnumerator(self.directory_path, with_stat=True, **self.enumerator_options)
+        return {file_path: stat_result and (stat_result.st_mtime_ns, stat_result.st_size) for file_path, stat_result in files}
+
+    def read(self, timeout):
+        wait = min(timeout, self.next_poll - time.monotonic())
+        if wait > 0:
+            time.sleep(wait)
+        if time.monotonic() < self.next_poll:
+            return []
+        snapshot = self.take_snapshot()
+        changed = [file_path for file_path in snapshot.keys() | self.snapshot.keys() if snapshot.get(file_path) != self.snapshot.get(file_path)]
+        self.snapshot = snapshot
+        self.next_poll = time.monotonic() + self.interval
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    # Linux inotify through ctypes, so no extra package is needed. Every directory of the tree has
+    # a watch, and directories that appear later get one as they are reported. read() returns the
+    # paths that changed; a directory that was created, moved or deleted is returned as its own
+    # path with a trailing separator, and the caller looks inside it.
+    def __init__(self, directory_path, exclude_dirs=None, max_depth=None):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.directory_path = directory_path
+        self.exclude_dirs = exclude_dirs
+        self.max_depth = max_depth
+        self.directories = {}
+        try:
+            self.watch_tree(directory_path)
+        except OSError:
+            self.close()
+            raise
+
+    def depth_of(self, directory):
+        relative_path = os.path.relpath(directory, self.directory_path)
+        return 0 if relative_path == '.' else relative_path.count(os.sep) + 1
+
+    def watch_tree(self, directory):
+        # Raises OSError if a watch cannot be added (usually fs.inotify.max_user_watches).
+        stack = [directory]
+        while stack:
+            directory = stack.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                raise OSError(error, f"Cannot watch {directory}: {os.strerror(error)}")
+            self.directories[wd] = directory
+            if self.max_depth is not None and self.depth_of(directory) >= self.max_depth:
+                continue
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False) and not self.is_excluded(entry.path):
+                            stack.append(entry.path)
+            except OSError as e:
+                logging.error(f"Error listing directory: {directory} - {str(e)}")
+
+    def is_excluded(self, directory):
+        if self.exclude_dirs is None:
+            return False
+        relative_path = os.path.relpath(directory, self.directory_path).replace(os.sep, '/')
+        return matches(self.exclude_dirs, os.path.basename(directory), relative_path)
+
+    def read(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b'\0'))
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                return RESCAN
+            if mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+                continue
+            directory = self.directories.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not self.is_excluded(path) and (self.max_depth is None or self.depth_of(path) <= self.max_depth):
+                    try:
+                        self.watch_tree(path)
+                    except OSError as e:
+                        logging.error(f"Error watching directory: {path} - {str(e)}")
+                path = os.path.join(path, '')
+            changed.append(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def create_watcher(directory_path, use_inotify=True, poll_interval=POLL_INTERVAL, **enumerator_options):
+    # inotify where it is available (and the watch limit allows), polling otherwise.
+    if use_inotify and sys.platform.startswith('linux'):
+        enumerator = FileEnumerator(directory_path, **enumerator_options)
+        try:
+            return InotifyWatcher(directory_path, exclude_dirs=enumerator.exclude_dirs, max_depth=enumerator.max_depth)
+        except (OSError, AttributeError) as e:
+            logging.warning(f"inotify unavailable, polling {directory_path} instead - {str(e)}")
+    return PollingWatcher(directory_path, interval=poll_interval, **enumerator_options)
+
+
+class DuplicateWatcher:
+    # Keeps a PositionIndex in step with directory_path. Create it before the initial scan (so
+    # nothing written during the scan is missed), fill the index with
+    # find_duplicate_and_near_duplicate_positions(watch_index=...), then call run(). The file options
+    # match those of the scan; watching never rewrites files.
+    def __init__(self, directory_path, index, file_pattern='*.json', exclude_patterns=(), exclude_dirs=(), max_depth=None, position_backend='scan', debounce=DEBOUNCE_SECONDS, poll_interval=POLL_INTERVAL, use_inotify=True):
+        self.directory_path = directory_path
+        self.index = index
+        self.enumerator_options = {'include': file_pattern, 'exclude': exclude_patterns, 'exclude_dirs': exclude_dirs, 'max_depth': max_depth}
+        # Only used to match paths against the patterns, never started.
+        self.filter = FileEnumerator(directory_path, **self.enumerator_options)
+        self.scan = partial(scan_file, position_backend=position_backend, match_keys=index.match_keys)
+        self.pending = Debouncer(debounce)
+        self.watcher = create_watcher(directory_path, use_inotify=use_inotify, poll_interval=poll_interval, **self.enumerator_options)
+
+    def is_wanted(self, file_path):
+        relative_path = os.path.relpath(file_path, self.directory_path).replace(os.sep, '/')
+        if relative_path.startswith('../'):
+            return False
+        parts = relative_path.split('/')
+        if self.filter.max_depth is not None and len(parts) - 1 > self.filter.max_depth:
+            return False
+        if self.filter.exclude_dirs is not None:
+            for depth in range(1, len(parts)):
+                if matches(self.filter.exclude_dirs, parts[depth - 1], '/'.join(parts[:depth])):
+                    return False
+        return self.filter.is_wanted(parts[-1], relative_path)
+
+    def expand(self, paths):
+        # Turns the reported paths into the files to look at: directories (reported with a trailing
+        # separator) stand for the files in them, both those listed now and those indexed before.
+        files = set()
+        for path in paths:
+            if path.endswith(os.sep):
+                path = path[:-1]
+                if os.path.isdir(path):
+                    files.update(file_path for file_path in FileEnumerator(path, **dict(self.enumerator_options, max_depth=None)) if self.is_wanted(file_path))
+                files.update(self.index.files_under(path))
+            elif path in self.index.key_of_file or self.is_wanted(path):
+                files.add(path)
+        return files
+
+    def apply(self, paths):
+        # Re-reads the given files and returns the resulting events. Files that are gone are taken out
+        # of the index before any are added, so a renamed file (or directory) is never reported as a
+        # duplicate of its own old path.
+        updates = [(file_path, self.scan(file_path)[1] if os.path.isfile(file_path) else None) for file_path in sorted(self.expand(paths))]
+        updates.sort(key=lambda update: update[1] is not None)
+        events = []
+        for file_path, position in updates:
+            events.extend(self.index.update(file_path, position))
+        return events
+
+    def rescan(self):
+        listed = {file_path for file_path in FileEnumerator(self.directory_path, **self.enumerator_options)}
+        return self.apply(listed | set(self.index.key_of_file))
+
+    def run(self, callback, control=None, stop_after=None):
+        # Calls callback(event) for every event until control (a ScanControl) is cancelled or, if
+        # given, stop_after seconds have passed.
+        deadline = None if stop_after is None else time.monotonic() + stop_after
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                if control is not None:
+                    control.checkpoint()
+                now = time.monotonic()
+                timeout = self.pending.timeout(now, POLL_INTERVAL)
+                if deadline is not None:
+                    timeout = min(timeout, max(0.0, deadline - now))
+                changed = self.watcher.read(timeout)
+                if changed is RESCAN:
+                    logging.warning(f"Watch events were lost, rescanning {self.directory_path}")
+                    events = self.rescan()
+                else:
+                    self.pending.add(changed, time.monotonic())
+                    events = self.apply(self.pending.pop_due(time.monotonic()))
+                for event in events:
+                    callback(event)
+        except ScanCancelled:
+            pass
+
+    def close(self):
+        self.watcher.close()
@@ -0,0 +1,112 @@
+import json
+import os
+import stat
+
+# Formats for rewritten files: indented, as this tool has always written them, or compact.
+FORMATS = {
+    'indented': {'indent': 4},
+    'compact': {'separators': (',', ':')},
+}
+
+
+def serialize(data, output_format='indented'):
+    return json.dumps(data, **FORMATS[output_format])
+
+
+def create_temp_file(directory, name):
+    # Creates a new, uniquely named temporary file next to name and returns (fd, path). Unlike
+    # mkstemp, it asks for mode 0o666 so the kernel applies the umask, as open() would for a new
+    # file; reading the umask would mean setting it, which races with other threads.
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0)
+    while True:
+        temp_path = os.path.join(directory, f'.{name}.{os.urandom(4).hex()}.tmp')
+        try:
+            return os.open(temp_path, flags, 0o666), temp_path
+        except FileExistsError:
+            continue
+
+
+def replace_file(file_path, text, fsync=False):
+    # Writes text to a temporary file next to file_path and renames it over the original, so a
+    # crash leaves either the old or the new file, never a partial one. The original's permission
+    # bits (and owner, where allowed) are kept, and a symlink keeps pointing at the rewritten file;
+    # a new file gets the usual umask-based mode. With fsync, the data is on disk before the
+    # rename. Returns the path that was replaced.
+    try:
+        original = os.lstat(file_path)
+        if stat.S_ISLNK(original.st_mode):
+            file_path = os.path.realpath(file_path)
+            original = os.stat(file_path)
+    except FileNotFoundError:
+        original = None
+    directory, name = os.path.split(file_path)
+    fd, temp_path = create_temp_file(directory or '.', name)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if original is not None:
+            os.chmod(temp_path, stat.S_IMODE(original.st_mode))
+            if hasattr(os, 'chown') and (original.st_uid, original.st_gid) != (os.getuid(), os.getgid()):
+                try:
+                    os.chown(temp_path, original.st_uid, original.st_gid)
+                except OSError:
+                    pass
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return file_path
+
+
+def fsync_directory(directory):
+    # Makes the renames in directory durable. Directories cannot be opened on Windows, where this
+    # does nothing.
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class WriteBack:
+    # Writes cleaned JSON files back: serialized in a single call, skipped when the text is
+    # unchanged and replaced atomically (see replace_file). With fsync, each file is flushed to
+    # disk before its rename, and the directories that had files replaced are fsynced once each
+    # by sync() rather than once per file. Instances are sent to worker processes as they are;
+    # each process syncs its own directories.
+    def __init__(self, output_format='indented', fsync=False):
+        if output_format not in FORMATS:
+            raise ValueError(f"Unknown output format: {output_format!r}")
+        self.output_format = output_format
+        self.fsync = fsync
+        self.pending_directories = set()
+
+    def write(self, file_path, data, original_text=None):
+        # Returns whether the file was written. original_text may also be the raw bytes of the
+        # file; the serialized text is ASCII (json escapes the rest), so it compares as bytes.
+        text = serialize(data, self.output_format)
+        if isinstance(original_text, bytes):
+            if text.encode('ascii') == original_text.replace(b'\r\n', b'\n'):
+                return False
+        elif text == original_text:
+            return False
+        replaced_path = replace_file(file_path, text, self.fsync)
+        if self.fsync:
+            self.pending_directories.add(os.path.dirname(replaced_path) or '.')
+        return True
+
+    def sync(self):
+        for directory in self.pending_directories:
+            fsync_directory(directory)
+        self.pending_directories.clear()